@@ -0,0 +1,29 @@
+import numpy as np
+from numba import njit
+
+# classify_seasons_clip.py の calculate_uncertainty_scores から、numba が入っている場合だけ使う
+# 列の順: least_confidence, margin_confidence, ratio_confidence, entropy
+
+@njit(fastmath=True, cache=True)
+def compute_metrics(P, out):
+    """
+    確率 P (N, 4) から 4 種類の不確実性スコアを 1 回の走査で計算し、out (N, 4) に書き込む
+    行ごとに上位 2 つを比較だけで求めるので、ソートも中間配列も作らない
+    """
+    for i in range(P.shape[0]):
+        top1 = -1.0
+        top2 = -1.0
+        entropy = 0.0
+        for k in range(P.shape[1]):
+            p = P[i, k]
+            if p > top1:
+                top2 = top1
+                top1 = p
+            elif p > top2:
+                top2 = p
+            if p > 0:  # scipy.special.xlogy と同じく p = 0 の項は 0 とする
+                entropy -= p * np.log(p)
+        out[i, 0] = 1.0 - top1
+        out[i, 1] = top1 - top2
+        out[i, 2] = top2 / top1 if top1 > 0 else 1.0
+        out[i, 3] = entropy
@@ -0,0 +1,15 @@
+from fastapi import Request
+from ..services.classify_service import ClassifyService
+from ..services.duplicate_service import DuplicateService
+from ..services.settings_service import SettingsService
+
+# サービスは main.py の lifespan で 1 度だけ生成され、app.state に保持される
+
+def get_classify_service(request: Request) -> ClassifyService:
+    return request.app.state.classify_service
+
+def get_duplicate_service(request: Request) -> DuplicateService:
+    return request.app.state.duplicate_service
+
+def get_settings_service(request: Request) -> SettingsService:
+    return request.app.state.settings_service
@@ -0,0 +1,88 @@
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+from collections import OrderedDict
+from email.utils import formatdate, parsedate
+from hashlib import md5
+from io import BytesIO
+from PIL import Image
+import os
+import threading
+
+CACHE_CONTROL = "public, max-age=3600"
+
+# Thumbnail cache bounded by total bytes (w may be up to 2048, so an entry count alone says little about memory)
+_THUMBNAIL_CACHE_BYTES = 64 << 20
+_thumbnail_cache: OrderedDict[tuple, bytes] = OrderedDict()
+_thumbnail_cache_size = 0
+_thumbnail_lock = threading.Lock()
+
+class _ImageFileResponse(FileResponse):
+    # Starlette hands the file to the server via the ASGI pathsend extension when available
+    # (zero-copy); otherwise it streams chunks, so use 1 MiB reads to cut per-chunk overhead.
+    chunk_size = 1 << 20
+
+def _validators(st: os.stat_result, variant: str = "") -> dict:
+    etag = md5(f"{st.st_mtime}-{st.st_size}{variant}".encode()).hexdigest()
+    return {
+        "ETag": f'"{etag}"',
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+        "Cache-Control": CACHE_CONTROL,
+    }
+
+def _is_not_modified(headers: dict, request: Request) -> bool:
+    """Evaluate If-None-Match / If-Modified-Since against the response validators."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        return headers["ETag"] in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return parsedate(if_modified_since) >= parsedate(headers["Last-Modified"])
+        except TypeError:
+            return False
+    return False
+
+def _render_thumbnail(path: str, width: int) -> bytes:
+    with Image.open(path) as img:
+        img.draft("RGB", (width, width))
+        img = img.convert("RGB")
+        img.thumbnail((width, width))
+        buf = BytesIO()
+        img.save(buf, format="JPEG", quality=85)
+        return buf.getvalue()
+
+def _thumbnail_bytes(path: str, mtime_ns: int, width: int) -> bytes:
+    """LRU-cached thumbnail; the least recently used entries are dropped once the cache exceeds _THUMBNAIL_CACHE_BYTES."""
+    global _thumbnail_cache_size
+    # mtime_ns is part of the cache key so edited files are re-rendered
+    key = (path, mtime_ns, width)
+    with _thumbnail_lock:
+        data = _thumbnail_cache.get(key)
+        if data is not None:
+            _thumbnail_cache.move_to_end(key)
+            return data
+
+    data = _render_thumbnail(path, width)
+    with _thumbnail_lock:
+        if key not in _thumbnail_cache:
+            _thumbnail_cache[key] = data
+            _thumbnail_cache_size += len(data)
+        while _thumbnail_cache_size > _THUMBNAIL_CACHE_BYTES:
+            _, evicted = _thumbnail_cache.popitem(last=False)
+            _thumbnail_cache_size -= len(evicted)
+    return data
+
+def image_response(request: Request, path: str, width: int = None) -> Response:
+    """
+    Serve an image with ETag/Last-Modified so browsers can revalidate with a 304.
+    When width is given, a cached JPEG thumbnail bounded to width x width is returned instead.
+    """
+    st = os.stat(path)
+    headers = _validators(st, f"-w{width}" if width else "")
+
+    if _is_not_modified(headers, request):
+        return Response(status_code=304, headers=headers)
+    if width:
+        return Response(_thumbnail_bytes(path, st.st_mtime_ns, width), media_type="image/jpeg", headers=headers)
+    return _ImageFileResponse(path, stat_result=st, headers=headers)
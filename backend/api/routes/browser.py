@@ -1,14 +1,24 @@
-from fastapi import APIRouter, HTTPException, Query # type: ignore
-from fastapi.responses import FileResponse # type: ignore
+from fastapi import APIRouter, HTTPException, Query, Request # type: ignore
 from pydantic import BaseModel # type: ignore
 import os
-from pathlib import Path
-from typing import List, Optional
+import asyncio
+import heapq
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from ..responses import image_response
 
 router = APIRouter()
 
 DEFAULT_FOLDER = os.getenv("WALLPAPER_TARGET_FOLDER", "")
 
+_SUFFIXES = ('.jpg', '.jpeg', '.png', '.webp')
+
+# folder -> (dir mtime_ns, directories, [(lowered name, file item)]), least recently used first
+_listing_cache: OrderedDict[str, Tuple[int, List[dict], List[Tuple[str, dict]]]] = OrderedDict()
+_LISTING_CACHE_SIZE = 64  # max folders kept; each entry holds a full listing
+_listing_lock = threading.Lock()
+
 class DirectoryItem(BaseModel):
     name: str
     path: str
@@ -26,6 +36,55 @@ class ImageListResponse(BaseModel):
     page: int
     limit: int
 
+def _scan_folder(target_folder: str) -> Tuple[List[dict], List[Tuple[str, dict]]]:
+    """
+    List sub-directories and image files of a folder.
+    The result is reused until the folder's own mtime changes (files added/removed/renamed).
+    """
+    base_abs = os.path.abspath(target_folder).replace('\\', '/').rstrip('/')
+    dir_mtime = os.stat(target_folder).st_mtime_ns
+    with _listing_lock:
+        cached = _listing_cache.get(base_abs)
+        if cached and cached[0] == dir_mtime:
+            _listing_cache.move_to_end(base_abs)
+            return cached[1], cached[2]
+
+    directories = []
+    files = []
+    with os.scandir(target_folder) as it:
+        for entry in it:
+            nm = entry.name
+            if nm.startswith('.'): continue # Skip hidden files
+
+            if entry.is_dir():
+                directories.append({
+                    "name": nm,
+                    "path": f"{base_abs}/{nm}"
+                })
+                continue
+
+            nm_l = nm.lower()
+            if not nm_l.endswith(_SUFFIXES) or not entry.is_file():
+                continue
+
+            stat = entry.stat()
+            files.append((nm_l, {
+                "filename": nm,
+                "path": f"{base_abs}/{nm}",
+                "size": stat.st_size,
+                "mtime": stat.st_mtime
+            }))
+
+    # Sort Directories (Always by name asc)
+    directories.sort(key=lambda x: x['name'].lower())
+
+    with _listing_lock:
+        _listing_cache[base_abs] = (dir_mtime, directories, files)
+        _listing_cache.move_to_end(base_abs)
+        while len(_listing_cache) > _LISTING_CACHE_SIZE:
+            _listing_cache.popitem(last=False)
+    return directories, files
+
 @router.get("/images", response_model=ImageListResponse)
 async def list_images(
     folder: Optional[str] = None,
@@ -44,47 +103,28 @@ async def list_images(
         raise HTTPException(status_code=404, detail=f"Folder not found: {target_folder}")
 
     try:
-        entries = os.scandir(target_folder)
-        directories = []
-        files = []
-        
-        for entry in entries:
-            if entry.name.startswith('.'): continue # Skip hidden files
-            
-            if entry.is_dir():
-                directories.append({
-                    "name": entry.name,
-                    "path": str(Path(entry.path).absolute().as_posix())
-                })
-            elif entry.is_file() and entry.name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
-                if search and search.lower() not in entry.name.lower():
-                    continue
-                    
-                stat = entry.stat()
-                files.append({
-                    "filename": entry.name,
-                    "path": str(Path(entry.path).absolute().as_posix()),
-                    "size": stat.st_size,
-                    "mtime": stat.st_mtime
-                })
+        directories, entries = _scan_folder(target_folder)
         
-        # Sort Directories (Always by name asc)
-        directories.sort(key=lambda x: x['name'].lower())
+        search_l = search.lower() if search else None
+        if search_l:
+            files = [item for nm_l, item in entries if search_l in nm_l]
+        else:
+            files = [item for _, item in entries]
 
-        # Sort Files
-        reverse = (order == "desc")
+        # Sort Files (only the items up to the requested page)
         if sort == "date":
-            files.sort(key=lambda x: x['mtime'], reverse=reverse)
+            key_fn = lambda x: x['mtime']
         elif sort == "size":
-            files.sort(key=lambda x: x['size'], reverse=reverse)
+            key_fn = lambda x: x['size']
         else: # name
-            files.sort(key=lambda x: x['filename'].lower(), reverse=reverse)
+            key_fn = lambda x: x['filename'].lower()
         
         total = len(files)
         start = (page - 1) * limit
         end = start + limit
         
-        paginated_files = files[start:end]
+        select = heapq.nlargest if order == "desc" else heapq.nsmallest
+        paginated_files = select(end, files, key=key_fn)[start:]
             
         return {
             "directories": directories,
@@ -97,10 +137,11 @@ async def list_images(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/image")
-async def get_image(path: str):
+async def get_image(request: Request, path: str, w: Optional[int] = Query(None, gt=0, le=2048)):
     """
-    Serve image file.
+    Serve image file (or a thumbnail of width w).
     """
     if not os.path.exists(path):
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(path)
+    # stat and thumbnail decode/encode are blocking; keep them off the event loop
+    return await asyncio.to_thread(image_response, request, path, w)
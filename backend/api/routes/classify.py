@@ -1,18 +1,32 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import os
 import shutil
 import asyncio
-from pathlib import Path
+import numpy as np
+import orjson
+try:
+    from numba import njit
+except ImportError:  # numba は任意。無ければ NumPy で計算する
+    njit = None
 from ...services.classify_service import ClassifyService
+from ..dependencies import get_classify_service
+from ..responses import image_response
 
 router = APIRouter()
-classify_service = ClassifyService()
+
+def _ndjson(obj: Dict) -> bytes:
+    # orjson は NumPy のスカラー/配列をそのまま直列化できるので float() 変換が不要
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE)
 
 DEFAULT_FOLDER = os.getenv("WALLPAPER_TARGET_FOLDER", "")
 
+_IMG_EXT = frozenset({'.jpg', '.jpeg', '.png'})
+_BATCH_SIZE = 32  # 1 回の CLIP forward にまとめる画像数
+_SEASONS = {"spring": "spring", "summer": "summer", "autumn": "autumn", "winter": "winter"}
+
 class ScanRequest(BaseModel):
     folder: str = DEFAULT_FOLDER
     threshold: float = 0.5
@@ -26,7 +40,7 @@ class ExecuteRequest(BaseModel):
     output_folder: Optional[str] = None
 
 @router.get("/preview")
-async def preview_image(path: str):
+async def preview_image(request: Request, path: str, w: Optional[int] = Query(None, gt=0, le=2048)):
     """画像をプレビュー用に配信する"""
     if not path or not os.path.exists(path):
         raise HTTPException(status_code=404, detail=f"File not found: {path}")
@@ -56,83 +70,164 @@ async def preview_image(path: str):
             raise e
         raise HTTPException(status_code=500, detail=f"Security check failed: {str(e)}")
 
-    return FileResponse(path)
+    # stat とサムネイルのデコード/エンコードはブロッキングなので、イベントループを止めないようスレッドで行う
+    return await asyncio.to_thread(image_response, request, path, w)
+
+_METRIC_IDS = {"probability": 0, "margin": 1, "entropy": 2}
+
+if njit is not None:
+    @njit(cache=True)
+    def _unknown_mask_jit(probs, metric_id, threshold):
+        # 1 行ずつ top1 / top2 / エントロピーを同時に求める（ソート不要の 1 パス）
+        n, k = probs.shape
+        out = np.zeros(n, dtype=np.bool_)
+        for i in range(n):
+            top1 = 0.0
+            top2 = 0.0
+            entropy = 0.0
+            for j in range(k):
+                p = probs[i, j]
+                if p > top1:
+                    top2 = top1
+                    top1 = p
+                elif p > top2:
+                    top2 = p
+                entropy -= p * np.log(p + 1e-10)
+            if metric_id == 0:
+                out[i] = top1 < threshold
+            elif metric_id == 1:
+                out[i] = (top1 - top2) < threshold
+            else:
+                out[i] = entropy > threshold
+        return out
+else:
+    _unknown_mask_jit = None
+
+def _unknown_mask(probs: np.ndarray, metric: str, threshold: float) -> np.ndarray:
+    """確率の配列 (N, 4) から、選択された指標で Unknown とみなす画像のマスクを返す"""
+    metric_id = _METRIC_IDS.get(metric)
+    if metric_id is None:
+        return np.zeros(len(probs), dtype=bool)
+    if _unknown_mask_jit is not None:
+        return _unknown_mask_jit(np.ascontiguousarray(probs, dtype=np.float32), metric_id, threshold)
+    
+    if metric_id == 0:
+        return probs.max(axis=1) < threshold
+    if metric_id == 1:
+        top2 = -np.sort(-probs, axis=1)[:, :2]
+        return (top2[:, 0] - top2[:, 1]) < threshold
+    entropy = -(probs * np.log(probs + 1e-10)).sum(axis=1)
+    return entropy > threshold
 
 @router.post("/scan")
-async def scan_seasons(request: ScanRequest):
+async def scan_seasons(request: ScanRequest, classify_service: ClassifyService = Depends(get_classify_service)):
+    """解析結果をバッチごとに NDJSON で逐次返す"""
     if not os.path.exists(request.folder):
         raise HTTPException(status_code=404, detail="Folder not found")
         
-    filenames = [f for f in os.listdir(request.folder) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-    results = []
+    base_abs = os.path.abspath(request.folder).replace('\\', '/').rstrip('/')
+    with os.scandir(request.folder) as it:
+        targets = [
+            f"{base_abs}/{e.name}" for e in it
+            if e.is_file(follow_symlinks=False) and os.path.splitext(e.name)[1].lower() in _IMG_EXT
+        ]
     
     try:
         classify_service.load_model()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Model load failed: {str(e)}")
     
-    targets = filenames
-    try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = asyncio.get_event_loop()
-    
-    async def process_batch(paths):
-        tasks = [loop.run_in_executor(None, classify_service.analyze_image_sync, p) for p in paths]
-        return await asyncio.gather(*tasks)
-
-    batch_size = request.workers
-    for i in range(0, len(targets), batch_size):
-        batch_filenames = targets[i:i + batch_size]
-        batch_paths = [os.path.join(request.folder, f) for f in batch_filenames]
-        batch_results = await process_batch(batch_paths)
+    async def generate():
+        yield _ndjson({"event": "start", "total": len(targets)})
         
-        for result in batch_results:
-            if result:
-                u = result['uncertainty']
-                is_unknown = False
-                if request.metric == "probability":
-                    max_prob = max(result['probs'].values())
-                    is_unknown = max_prob < request.threshold
-                elif request.metric == "margin":
-                    is_unknown = u['margin_confidence'] < request.threshold
-                elif request.metric == "entropy":
-                    is_unknown = u['entropy'] > request.threshold
-                    
-                result['path'] = Path(result['path']).absolute().as_posix()
+        # デコード・前処理は workers 個のプロセスで先読みし、推論と並行させる
+        batches = classify_service.iter_batches(targets, request.workers, _BATCH_SIZE)
+        processed = 0
+        scanned = 0
+        while True:
+            batch = await asyncio.to_thread(next, batches, None)
+            if batch is None:
+                break
+            batch_results, probs = await asyncio.to_thread(classify_service.analyze_pixel_values_sync, *batch)
+            unknown = _unknown_mask(probs, request.metric, request.threshold)
+            
+            # probs の行は None 以外の結果と同じ順に並んでいる
+            for result, is_unknown in zip((r for r in batch_results if r), unknown.tolist()):
                 result['is_unknown'] = is_unknown
-                results.append(result)
+                processed += 1
+                yield _ndjson({"event": "result", "result": result})
             
-    return {"results": results, "total_processed": len(results), "skipped": len(filenames) - len(results)}
+            scanned += len(batch_results)
+            yield _ndjson({"event": "progress", "scanned": scanned})
+        
+        yield _ndjson({"event": "done", "total_processed": processed, "skipped": len(targets) - processed})
 
-@router.post("/execute")
-async def execute_classification(request: ExecuteRequest):
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+def _transfer_group(mode: str, target_dir: str, pairs: List[Tuple[str, str]], src_devs: Dict[str, int]) -> Tuple[int, List[str]]:
+    """同じ出力先フォルダへのファイルをまとめて移動/コピーする"""
+    dest_dev = None
     success_count = 0
     errors = []
+    for src_path, dest_path in pairs:
+        try:
+            if dest_dev is None:
+                # 元ファイルが 1 つも無いグループで空のフォルダを作らないよう、最初に転送できるファイルが見つかってから作る
+                os.stat(src_path)
+                os.makedirs(target_dir, exist_ok=True)
+                dest_dev = os.stat(target_dir).st_dev
+            if mode == 'move':
+                # 同じボリューム内なら rename 1 回で済む。別ボリュームはコピーして削除
+                if src_devs.get(os.path.dirname(src_path)) == dest_dev:
+                    os.replace(src_path, dest_path)
+                else:
+                    shutil.copy2(src_path, dest_path)
+                    os.unlink(src_path)
+            else:
+                shutil.copy2(src_path, dest_path)
+            success_count += 1
+        except FileNotFoundError:
+            errors.append(f"File not found: {src_path}")
+        except Exception as e:
+            errors.append(f"Error {mode}ing {os.path.basename(src_path)}: {e}")
+    return success_count, errors
+
+@router.post("/execute")
+async def execute_classification(request: ExecuteRequest):
     base_target = request.output_folder if request.output_folder else request.folder
     
+    # 出力先フォルダごとにまとめ、makedirs をフォルダ単位で 1 回にする
+    groups: Dict[str, List[Tuple[str, str]]] = {}
     for item in request.results:
         src_path = item['path']
-        if not os.path.exists(src_path):
-            errors.append(f"File not found: {src_path}")
-            continue
-            
         if item.get('is_unknown'):
             subfolder = "unknown"
+        elif item.get('label'):
+            # label はクライアントから送られてくる値なので、季節名以外（"../x" や絶対パスなど）は unknown 扱いにする
+            subfolder = _SEASONS.get(item['label'], "unknown")
         else:
-            subfolder = item['prediction'].split(' ').pop().lower()
+            # label を持たない古い形式の結果は prediction から復元する
+            tail = item.get('prediction', '').rpartition(' ')[2].lower()
+            subfolder = _SEASONS.get(tail, "unknown")
             
         target_dir = os.path.join(base_target, subfolder)
-        os.makedirs(target_dir, exist_ok=True)
         dest_path = os.path.join(target_dir, os.path.basename(src_path))
-        
+        groups.setdefault(target_dir, []).append((src_path, dest_path))
+    
+    # 元フォルダのデバイス番号はフォルダごとに 1 回だけ調べる
+    src_devs: Dict[str, int] = {}
+    for src_dir in {os.path.dirname(src) for pairs in groups.values() for src, _ in pairs}:
         try:
-            if request.mode == 'move':
-                shutil.move(src_path, dest_path)
-            else:
-                shutil.copy2(src_path, dest_path)
-            success_count += 1
-        except Exception as e:
-            errors.append(f"Error {request.mode}ing {os.path.basename(src_path)}: {e}")
+            src_devs[src_dir] = os.stat(src_dir).st_dev
+        except OSError:
+            pass
+    
+    outcomes = await asyncio.gather(*(
+        asyncio.to_thread(_transfer_group, request.mode, target_dir, pairs, src_devs)
+        for target_dir, pairs in groups.items()
+    ))
+    
+    success_count = sum(count for count, _ in outcomes)
+    errors = [error for _, group_errors in outcomes for error in group_errors]
             
     return {"message": f"Successfully {request.mode}d {success_count} files", "errors": errors}
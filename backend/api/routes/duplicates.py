@@ -1,30 +1,34 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import Response
+from pydantic import BaseModel, Field
 import os
+import orjson
 from ...services.duplicate_service import DuplicateService
+from ..dependencies import get_duplicate_service
 
 router = APIRouter()
-duplicate_service = DuplicateService()
 
 DEFAULT_FOLDER = os.getenv("WALLPAPER_TARGET_FOLDER", "")
 
 class ScanRequest(BaseModel):
     folder: str = DEFAULT_FOLDER
     workers: int = 4
+    threshold: int = Field(6, ge=0, le=64)  # pHash のハミング距離がこの値以下なら重複とみなす（64 ビットなので 0〜64）
 
 class DeleteRequest(BaseModel):
     path: str
 
 @router.post("/scan")
-async def scan_duplicates(request: ScanRequest):
+async def scan_duplicates(request: ScanRequest, duplicate_service: DuplicateService = Depends(get_duplicate_service)):
     try:
-        duplicates = await duplicate_service.find_similar_images(request.folder, request.workers)
-        return {"duplicates": duplicates}
+        duplicates = await duplicate_service.find_similar_images(request.folder, request.workers, request.threshold)
+        # グループ数が多いと jsonable_encoder による変換が重いので、orjson で直接シリアライズする
+        return Response(orjson.dumps({"duplicates": duplicates}), media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/delete")
-async def delete_duplicate(request: DeleteRequest):
+async def delete_duplicate(request: DeleteRequest, duplicate_service: DuplicateService = Depends(get_duplicate_service)):
     if duplicate_service.delete_image(request.path):
         return {"message": "Deleted successfully"}
     raise HTTPException(status_code=404, detail="File not found")
@@ -1,28 +1,32 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 import os
 from pydantic import BaseModel
 from ...services.settings_service import SettingsService
+from ..dependencies import get_settings_service
 
 router = APIRouter()
-settings_service = SettingsService()
 
 DEFAULT_FOLDER = os.getenv("WALLPAPER_TARGET_FOLDER", "")
 
+_IMG_EXT = frozenset({'.jpg', '.jpeg', '.png', '.webp'})
+
 class SaveSettingsRequest(BaseModel):
     target_folder: str
     output_folder: str
     workers: int
 
 @router.post("/save")
-async def save_settings(request: SaveSettingsRequest):
+async def save_settings(request: SaveSettingsRequest, settings_service: SettingsService = Depends(get_settings_service)):
     """設定を保存する"""
-    settings_service.update_env_variable("WALLPAPER_TARGET_FOLDER", request.target_folder)
-    settings_service.update_env_variable("WALLPAPER_OUTPUT_FOLDER", request.output_folder)
-    settings_service.update_env_variable("WALLPAPER_WORKERS", str(request.workers))
+    settings_service.update_env_variables({
+        "WALLPAPER_TARGET_FOLDER": request.target_folder,
+        "WALLPAPER_OUTPUT_FOLDER": request.output_folder,
+        "WALLPAPER_WORKERS": str(request.workers),
+    })
     return {"message": "Settings saved successfully"}
 
 @router.get("/browse")
-async def browse_folder(initial_dir: str = DEFAULT_FOLDER):
+async def browse_folder(initial_dir: str = DEFAULT_FOLDER, settings_service: SettingsService = Depends(get_settings_service)):
     """フォルダ選択ダイアログを開く"""
     selected_path = settings_service.browse_folder(initial_dir)
     return {"path": selected_path}
@@ -33,9 +37,13 @@ async def get_stats(folder: str = DEFAULT_FOLDER):
     if not os.path.exists(folder):
         return {"total_images": 0, "duplicates": 0, "classified": 0}
         
-    filenames = [f for f in os.listdir(folder) if f.lower().endswith(('.jpg', '.jpeg', '.png', '.webp'))]
+    with os.scandir(folder) as it:
+        total_images = sum(
+            1 for e in it
+            if e.is_file(follow_symlinks=False) and os.path.splitext(e.name)[1].lower() in _IMG_EXT
+        )
     return {
-        "total_images": len(filenames),
+        "total_images": total_images,
         "duplicates": 0,
         "classified": 0
     }
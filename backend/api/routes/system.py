@@ -1,9 +1,9 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 import os
 from ...services.classify_service import ClassifyService
+from ..dependencies import get_classify_service
 
 router = APIRouter()
-classify_service = ClassifyService()
 
 @router.get("/status")
 async def get_status():
@@ -11,7 +11,7 @@ async def get_status():
     return {"status": "ok", "folder": default_folder}
 
 @router.get("/info")
-async def get_system_info():
+async def get_system_info(classify_service: ClassifyService = Depends(get_classify_service)):
     """システム情報を取得する（CPUコア数など）"""
     device = "CUDA" if classify_service.device == "cuda" else "CPU"
     cores = os.cpu_count() or 4
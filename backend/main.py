@@ -1,14 +1,34 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+import asyncio
 import os
 from .api import endpoints
+from .services.classify_service import ClassifyService
+from .services.duplicate_service import DuplicateService
+from .services.settings_service import SettingsService
 
 # 環境変数の読み込み
 env_path = os.path.join(os.path.dirname(__file__), ".env")
 load_dotenv(dotenv_path=env_path, override=True)
 
-app = FastAPI(title="Wallpaper Management API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # サービスはプロセスごとに 1 つだけ生成し、各ルートには Depends で渡す
+    app.state.classify_service = ClassifyService()
+    app.state.duplicate_service = DuplicateService()
+    app.state.settings_service = SettingsService()
+
+    # 初回リクエストでモデル読み込みを待たせないよう起動時に読み込んでおく
+    try:
+        await asyncio.to_thread(app.state.classify_service.load_model)
+    except Exception as e:
+        print(f"Model preload failed, will retry on first scan: {e}")
+    yield
+
+app = FastAPI(title="Wallpaper Management API", lifespan=lifespan)
 
 # CORS設定
 app.add_middleware(
@@ -19,6 +39,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# スキャン結果の JSON / NDJSON はキーの繰り返しが多く圧縮が効く（画像は既定で対象外）
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 app.include_router(endpoints.router, prefix="/api")
 
 @app.get("/")
@@ -1,12 +1,17 @@
 import os
 import torch
+import torch.nn.functional as F
 import numpy as np
 from PIL import Image
+from torch.utils.data import DataLoader, Dataset
 from transformers import CLIPProcessor, CLIPModel
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional, Tuple
 import logging
-import gc
 import threading
+try:
+    from torchvision.io import ImageReadMode, decode_jpeg, read_file
+except ImportError:  # torchvision は任意。無ければ PIL でデコードする
+    decode_jpeg = None
 
 logger = logging.getLogger(__name__)
 
@@ -16,13 +21,73 @@ SEASON_LABELS = [
     "a photo of autumn",
     "a photo of winter"
 ]
+SEASON_CLASSES = ["spring", "summer", "autumn", "winter"]  # SEASON_LABELS と同じ順
+_DECODE_SIZE = 256  # draft デコード時に最低限確保する短辺の長さ
+_JPEG_EXT = (".jpg", ".jpeg")
+_PREFETCH_BATCHES = 4  # DataLoader のワーカー 1 つあたりの先読みバッチ数
+_COMPILE_BATCH = 32  # コンパイル済みの画像エンコーダに渡すバッチサイズ（scan のバッチサイズと同じ）。端数のバッチはこの枚数まで埋める
+
+def _open_image(image_path: str) -> Optional[Image.Image]:
+    """画像を RGB で読み込む。失敗時は None"""
+    try:
+        with Image.open(image_path) as raw_img:
+            # CLIP の入力は 224px なので、JPEG は縮小デコード（1/2〜1/8）で十分
+            raw_img.draft("RGB", (_DECODE_SIZE, _DECODE_SIZE))
+            return raw_img.convert("RGB")
+    except Exception as e:
+        print(f"Error analyzing image {image_path}: {e}")
+        return None
+
+class _ImageDataset(Dataset):
+    """
+    パスごとに (パス, テンソル, JPEG のバイト列かどうか) を返す。DataLoader のワーカープロセスでデコード・前処理を行う。
+    encoded_jpeg=True の場合、JPEG はファイルを読むだけにして、メインプロセスで nvJPEG により GPU 上でデコードする。
+    """
+    def __init__(self, image_paths: List[str], processor, encoded_jpeg: bool = False):
+        self.image_paths = image_paths
+        self.processor = processor
+        self.encoded_jpeg = encoded_jpeg
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def __getitem__(self, idx):
+        image_path = self.image_paths[idx]
+        if self.encoded_jpeg and image_path.lower().endswith(_JPEG_EXT):
+            try:
+                return image_path, read_file(image_path), True
+            except Exception as e:
+                print(f"Error analyzing image {image_path}: {e}")
+                return image_path, None, False
+        image = _open_image(image_path)
+        if image is None:
+            return image_path, None, False
+        return image_path, self.processor(images=image, return_tensors="pt")["pixel_values"][0], False
+
+def _collate_batch(items) -> Tuple[List[str], List[bool], Optional[torch.Tensor], List[Tuple[int, torch.Tensor]]]:
+    """
+    (paths, valid, pixel_values, jpeg_data) にまとめる。
+    jpeg_data は (有効な画像の中での行番号, JPEG のバイト列) のリストで、pixel_values はそれ以外の行を順に並べたもの。
+    """
+    paths = [path for path, _, _ in items]
+    valid = [tensor is not None for _, tensor, _ in items]
+    loaded = [(tensor, encoded) for _, tensor, encoded in items if tensor is not None]
+    tensors = [tensor for tensor, encoded in loaded if not encoded]
+    jpeg_data = [(row, tensor) for row, (tensor, encoded) in enumerate(loaded) if encoded]
+    return paths, valid, torch.stack(tensors) if tensors else None, jpeg_data
 
 class ClassifyService:
     def __init__(self):
         self.model = None
         self.processor = None
+        self.text_features = None
+        self.logit_scale = None
+        self.pixel_mean = None
+        self.pixel_std = None
+        self.compiled = False
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.lock = threading.Lock()
+        self.inference_lock = threading.Lock()
         print(f"ClassifyService initialized with device: {self.device}")
 
     def load_model(self):
@@ -32,54 +97,191 @@ class ClassifyService:
                     print(f"Loading CLIP model into {self.device}...")
                     self.model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32").to(self.device)
                     self.processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32", use_fast=False)
+                    self.model.eval()
+                    if self.device == "cuda":
+                        # 推論のみなので GPU では半精度の重みで十分。BF16 をネイティブに扱える Ampere 以降ならオーバーフローの心配がない方を選ぶ
+                        # （is_bf16_supported() は Turing/Volta のエミュレーションでも True を返し、FP16 より遅くなるので使わない）
+                        native_bf16 = torch.cuda.get_device_capability()[0] >= 8
+                        half_dtype = torch.bfloat16 if native_bf16 else torch.float16
+                        self.model = self.model.to(half_dtype)
+                    
+                    # ラベルは固定なのでテキスト埋め込みは読み込み時に 1 回だけ計算する
+                    text_inputs = self.processor(text=SEASON_LABELS, return_tensors="pt", padding=True).to(self.device)
+                    with torch.inference_mode():
+                        text_features = self.model.get_text_features(**text_inputs)
+                    self.text_features = F.normalize(text_features.float(), dim=-1)
+                    self.logit_scale = self.model.logit_scale.exp().item()
+                    image_processor = self.processor.image_processor
+                    self.pixel_mean = torch.tensor(image_processor.image_mean, device=self.device).view(1, 3, 1, 1)
+                    self.pixel_std = torch.tensor(image_processor.image_std, device=self.device).view(1, 3, 1, 1)
+                    if self.device == "cuda":
+                        # コンパイルには時間がかかるので、起動（lifespan の load_model）を止めないよう別スレッドで行う
+                        threading.Thread(target=self._compile_vision_model, daemon=True).start()
                     print("Model loaded successfully.")
                 except Exception as e:
                     print(f"FAILED to load model: {e}")
                     raise e
 
-    def calculate_uncertainty(self, probs):
-        sorted_probs = np.sort(probs)[::-1]
+    def _compile_vision_model(self):
+        """
+        画像エンコーダを torch.compile でカーネル融合する（バックグラウンドスレッドで実行）。
+        入力は常に (_COMPILE_BATCH, 3, 224, 224) にそろえるので、形状は固定（dynamic=False）でコンパイルする。
+        推論は asyncio.to_thread のどのスレッドからも呼ばれるため、CUDA グラフを使うモードは使わない。
+        コンパイルとダミー入力でのウォームアップが終わるまでは inference_lock を握り、その間の推論は待たせる。
+        失敗した場合（Triton が無い環境など）は通常の forward に戻す。
+        """
+        with self.inference_lock:
+            eager_vision_model = self.model.vision_model
+            try:
+                self.model.vision_model = torch.compile(eager_vision_model, dynamic=False)
+                size = self.processor.image_processor.crop_size["height"]
+                dummy = torch.zeros(_COMPILE_BATCH, 3, size, size, device=self.device, dtype=self.model.dtype)
+                with torch.inference_mode():
+                    self.model.get_image_features(pixel_values=dummy)
+                self.compiled = True
+                print("Vision model compiled.")
+            except Exception as e:
+                print(f"torch.compile unavailable, using eager vision model: {e}")
+                self.model.vision_model = eager_vision_model
+
+    def calculate_uncertainty(self, probs: torch.Tensor) -> Dict[str, torch.Tensor]:
+        """probs は (..., 4) のテンソル。最後の軸ごとに各指標をデバイス上で計算する"""
+        top2 = torch.topk(probs, 2, dim=-1).values
         epsilon = 1e-10
-        entropy = -np.sum(probs * np.log(probs + epsilon))
+        entropy = -(probs * torch.log(probs + epsilon)).sum(dim=-1)
         return {
-            "least_confidence": float(1.0 - sorted_probs[0]),
-            "margin_confidence": float(sorted_probs[0] - sorted_probs[1]),
-            "entropy": float(entropy)
+            "least_confidence": 1.0 - top2[..., 0],
+            "margin_confidence": top2[..., 0] - top2[..., 1],
+            "entropy": entropy
         }
 
-    def analyze_image_sync(self, image_path: str) -> Optional[Dict]:
-        """同期的な解析処理。非同期ループ内での競合を避ける"""
+    def _to_host(self, probs: torch.Tensor) -> Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+        """
+        確率・予測クラス・不確実性指標を 1 つのテンソルにまとめ、CPU への転送（GPU との同期）を 1 回で済ませる。
+        戻り値は (確率, 予測クラスの index, 不確実性指標)。
+        """
+        uncertainty = self.calculate_uncertainty(probs)
+        top_indices = probs.argmax(dim=-1, keepdim=True).to(probs.dtype)
+        packed = torch.cat([probs, top_indices, torch.stack(list(uncertainty.values()), dim=-1)], dim=-1).cpu().numpy()
+        n_classes = probs.shape[-1]
+        return (
+            packed[:, :n_classes],
+            packed[:, n_classes].astype(np.intp),
+            {name: packed[:, n_classes + 1 + i] for i, name in enumerate(uncertainty)},
+        )
+
+    def _build_results(self, image_paths: List[str], probs: np.ndarray, top_indices: np.ndarray, uncertainty: Dict[str, np.ndarray]) -> List[Dict]:
+        return [
+            {
+                "filename": os.path.basename(image_path),
+                "path": image_path,
+                "prediction": SEASON_LABELS[top_idx],
+                "label": SEASON_CLASSES[top_idx],
+                "probs": dict(zip(SEASON_CLASSES, row)),
+                "uncertainty": {name: values[i] for name, values in uncertainty.items()}
+            }
+            for i, (image_path, row, top_idx) in enumerate(zip(image_paths, probs, top_indices))
+        ]
+
+    def _decode_jpegs_on_device(self, jpeg_data: List[torch.Tensor]) -> torch.Tensor:
+        """
+        JPEG のバイト列を nvJPEG でまとめて GPU 上にデコードし、CLIPProcessor と同じ前処理
+        （短辺 224px へ bicubic リサイズ → 中央切り抜き → 正規化）をテンソル演算で行う。
+        """
+        size = self.processor.image_processor.crop_size["height"]
+        crops = []
+        for img in decode_jpeg(jpeg_data, mode=ImageReadMode.RGB, device=self.device):
+            img = img.unsqueeze(0).float() / 255.0
+            h, w = img.shape[-2:]
+            scale = size / min(h, w)
+            img = F.interpolate(img, size=(max(size, round(h * scale)), max(size, round(w * scale))), mode="bicubic", antialias=True)
+            top = (img.shape[-2] - size) // 2
+            left = (img.shape[-1] - size) // 2
+            crops.append(img[..., top:top + size, left:left + size])
+        return (torch.cat(crops).clamp_(0.0, 1.0) - self.pixel_mean) / self.pixel_std
+
+    def _device_pixel_values(self, image_paths: List[str], valid: List[bool], pixel_values: Optional[torch.Tensor], jpeg_data: List[Tuple[int, torch.Tensor]]) -> Optional[torch.Tensor]:
+        """
+        DataLoader が CPU で前処理した画像と GPU でデコードした JPEG を、有効な画像の順に 1 つのバッチにまとめる。
+        nvJPEG でデコードできなかった場合は PIL で読み直し、それも失敗した画像は valid を False にする。
+        """
+        valid_indices = [i for i, ok in enumerate(valid) if ok]
+        rows: List[Optional[torch.Tensor]] = [None] * len(valid_indices)
+        if pixel_values is not None:
+            jpeg_rows = {row for row, _ in jpeg_data}
+            cpu_rows = [row for row in range(len(rows)) if row not in jpeg_rows]
+            for row, values in zip(cpu_rows, pixel_values.to(self.device, non_blocking=True)):
+                rows[row] = values
+        try:
+            for (row, _), values in zip(jpeg_data, self._decode_jpegs_on_device([data for _, data in jpeg_data])):
+                rows[row] = values
+        except Exception as e:
+            # 壊れた JPEG が混ざっているとバッチ全体が失敗するので、この分だけ PIL で読み直す
+            logger.debug(f"GPU decode failed, falling back to PIL: {e}")
+            for row, _ in jpeg_data:
+                image = _open_image(image_paths[valid_indices[row]])
+                if image is not None:
+                    rows[row] = self.processor(images=image, return_tensors="pt")["pixel_values"][0].to(self.device)
+        for row, values in enumerate(rows):
+            if values is None:
+                valid[valid_indices[row]] = False
+        kept = [values for values in rows if values is not None]
+        return torch.stack(kept) if kept else None
+
+    def iter_batches(self, image_paths: List[str], workers: int = 0, batch_size: int = 32) -> Iterator[Tuple[List[str], List[bool], Optional[torch.Tensor], List[Tuple[int, torch.Tensor]]]]:
+        """
+        (paths, valid, pixel_values, jpeg_data) のバッチを順に返す。
+        workers > 0 の場合はデコード・前処理を別プロセスで先読みし、GPU の推論と重ねる。
+        GPU で torchvision が使える場合、JPEG はワーカーでは読み込むだけにして analyze_pixel_values_sync で nvJPEG でデコードする。
+        """
+        self.load_model()
+        # バッチが 1 つなら先読みする意味がない。ワーカーはバッチ数より多く起動しない（Windows では起動ごとに torch を import し直す）
+        n_batches = -(-len(image_paths) // batch_size)
+        num_workers = min(workers, n_batches) if n_batches > 1 else 0
+        loader = DataLoader(
+            _ImageDataset(image_paths, self.processor, encoded_jpeg=decode_jpeg is not None and self.device == "cuda"),
+            batch_size=batch_size,
+            num_workers=num_workers,
+            pin_memory=self.device == "cuda",
+            collate_fn=_collate_batch,
+            # 各ワーカーが先に用意しておくバッチ数。推論中に次のバッチのデコードを終わらせておく
+            prefetch_factor=_PREFETCH_BATCHES if num_workers > 0 else None,
+        )
+        return iter(loader)
+
+    def analyze_pixel_values_sync(self, image_paths: List[str], valid: List[bool], pixel_values: Optional[torch.Tensor], jpeg_data: List[Tuple[int, torch.Tensor]] = ()) -> Tuple[List[Optional[Dict]], np.ndarray]:
+        """
+        前処理済みのバッチを 1 回の forward で解析する。jpeg_data があれば GPU 上でデコードして合わせる。
+        戻り値は (結果のリスト, 確率の配列 (有効な画像数, 4))。valid が False の位置の結果は None。
+        """
+        results: List[Optional[Dict]] = [None] * len(image_paths)
+        empty = np.empty((0, len(SEASON_LABELS)), dtype=np.float32)
+        if pixel_values is None and not jpeg_data:
+            return results, empty
+        
         try:
-            self.load_model()
-            
-            with Image.open(image_path) as raw_img:
-                image = raw_img.convert("RGB")
-                inputs = self.processor(text=SEASON_LABELS, images=image, return_tensors="pt", padding=True).to(self.device)
-                
-                with torch.no_grad():
-                    outputs = self.model(**inputs)
-                
-                probs = outputs.logits_per_image.softmax(dim=1).detach().cpu().numpy()[0]
-                top_idx = probs.argmax()
-                uncertainty = self.calculate_uncertainty(probs)
-                
-                result = {
-                    "filename": os.path.basename(image_path),
-                    "path": image_path,
-                    "prediction": SEASON_LABELS[top_idx],
-                    "probs": {label.split()[-1]: float(p) for label, p in zip(SEASON_LABELS, probs)},
-                    "uncertainty": uncertainty
-                }
-                
-                # 強力なメモリ解放
-                del inputs, outputs, image
-                gc.collect()
-                if self.device == "cuda":
-                    torch.cuda.empty_cache()
-                
-                return result
-                
+            # GPU への投入は 1 スレッドずつにする
+            with self.inference_lock:
+                if jpeg_data:
+                    pixel_values = self._device_pixel_values(image_paths, valid, pixel_values, jpeg_data)
+                    if pixel_values is None:
+                        return results, empty
+                pixel_values = pixel_values.to(self.device, dtype=self.model.dtype, non_blocking=True)
+                n = len(pixel_values)
+                if self.compiled and n < _COMPILE_BATCH:
+                    # 形状を変えて再コンパイルさせないよう、端数のバッチはゼロ埋めしてそろえる（結果は先頭 n 枚だけ使う）
+                    pixel_values = F.pad(pixel_values, (0, 0, 0, 0, 0, 0, 0, _COMPILE_BATCH - n))
+                with torch.inference_mode():
+                    image_features = self.model.get_image_features(pixel_values=pixel_values)[:n]
+                    image_features = F.normalize(image_features.float(), dim=-1)
+                    logits = self.logit_scale * image_features @ self.text_features.T
+                    probs, top_indices, uncertainty = self._to_host(logits.softmax(dim=1))
         except Exception as e:
-            print(f"Error analyzing image {image_path}: {e}")
-            gc.collect()
-            return None
+            print(f"Error analyzing batch of {sum(valid)} images: {e}")
+            return results, empty
+        
+        valid_indices = [i for i, ok in enumerate(valid) if ok]
+        built = self._build_results([image_paths[i] for i in valid_indices], probs, top_indices, uncertainty)
+        for i, result in zip(valid_indices, built):
+            results[i] = result
+        return results, probs
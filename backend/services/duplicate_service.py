@@ -1,57 +1,179 @@
 import os
-import imagehash
+import asyncio
+import sqlite3
+import numpy as np
 from pathlib import Path
 from PIL import Image
-from typing import List, Tuple, Dict
+from typing import List, Tuple, Dict, Optional
 import logging
-from concurrent.futures import ThreadPoolExecutor
-from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 
 logger = logging.getLogger(__name__)
 
+_IMG_EXT = frozenset({".png", ".jpg", ".jpeg", ".bmp"})
+
+# (path, size, mtime) が変わらない画像の pHash を再計算しないためのキャッシュ
+PHASH_DB_PATH = os.path.join(os.path.expanduser("~"), ".cache", "wallpaper_ai", "phash.sqlite")
+
+def open_phash_db() -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(PHASH_DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(PHASH_DB_PATH)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS phash ("
+        "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, h TEXT NOT NULL)"
+    )
+    return conn
+
+# 1 バイトごとの立っているビット数
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def _popcount64(x: np.ndarray) -> np.ndarray:
+    """uint64 配列の要素ごとのビット数。NumPy 2.0 以降は popcnt 命令を使う np.bitwise_count を使う"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x)
+    return _POPCOUNT8[x.view(np.uint8)].reshape(*x.shape, 8).sum(axis=-1, dtype=np.uint8)
+_PAIR_BLOCK = 512  # 一度に比較する行数（メモリ使用量を N * 512 * 8 バイトに抑える）
+
+def _hamming_pairs(hashes: np.ndarray, threshold: int) -> Tuple[np.ndarray, np.ndarray]:
+    """uint64 のハッシュ配列から、ハミング距離が threshold 以下の組 (i < j) を返す"""
+    n = len(hashes)
+    left, right = [], []
+    for start in range(0, n, _PAIR_BLOCK):
+        block = hashes[start:start + _PAIR_BLOCK]
+        xor = block[:, None] ^ hashes[None, start:]
+        dist = _popcount64(xor)
+        ii, jj = np.nonzero(dist <= threshold)
+        ii += start
+        jj += start
+        keep = ii < jj
+        left.append(ii[keep])
+        right.append(jj[keep])
+    if not left:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    return np.concatenate(left), np.concatenate(right)
+
+# pHash: 32x32 グレースケールの 2 次元 DCT-II の低周波 8x8 成分を中央値で 2 値化する（imagehash.phash と同じ値）
+_PHASH_SIZE = 8
+_PHASH_IMG_SIZE = _PHASH_SIZE * 4
+_PHASH_DRAFT_SIZE = _PHASH_IMG_SIZE * 2  # 縮小デコード後も最低限確保する辺の長さ
+_DCT_LOW = np.cos(
+    np.pi * np.arange(_PHASH_SIZE)[:, None] * (2 * np.arange(_PHASH_IMG_SIZE)[None, :] + 1) / (2 * _PHASH_IMG_SIZE)
+)  # (8, 32)。scipy の dct とは定数倍だけ異なるが、中央値との比較には影響しない
+
+def phash_hex(img: Image.Image) -> str:
+    """
+    imagehash.phash 互換の 16 桁 hex 文字列を返す。
+    scipy の 32 点 DCT を 2 回呼ぶ代わりに、必要な低周波 8 行分だけを行列積 2 回で求める。
+    """
+    pixels = np.asarray(img.convert("L").resize((_PHASH_IMG_SIZE, _PHASH_IMG_SIZE), Image.LANCZOS), dtype=np.float64)
+    # 単色画像などで 0 になるはずの成分に乗る丸め誤差で、中央値との大小が揺れないようにする
+    low = np.round(_DCT_LOW @ pixels @ _DCT_LOW.T, 6)
+    bits = np.packbits(low.ravel() > np.median(low))
+    return bits.tobytes().hex()
+
+def _phash_worker(target: Tuple[str, str, int, int]) -> Optional[Tuple[str, str, int, int]]:
+    """プロセスプールから呼ぶので module レベルに置く（pickle できる必要がある）"""
+    filename, full_path, size, mtime_ns = target
+    try:
+        with Image.open(full_path) as img:
+            # pHash は 32x32 に縮小するので、JPEG は DCT スケーリングで縮小デコードすれば十分（PNG/BMP では何もしない）
+            img.draft("L", (_PHASH_DRAFT_SIZE, _PHASH_DRAFT_SIZE))
+            img_hash = phash_hex(img)
+            return (img_hash, full_path, size, mtime_ns)
+    except Exception as e:
+        logger.error(f"Failed to process {filename}: {e}")
+        return None
+
 class DuplicateService:
     @staticmethod
-    async def find_similar_images(folder: str, max_workers: int = 4) -> List[Dict]:
-        hash_dict = {}
+    async def find_similar_images(folder: str, max_workers: int = 4, threshold: int = 6) -> List[Dict]:
+        """
+        類似画像のグループを返す。
+        pHash のハミング距離が threshold 以下の画像同士を同じグループにまとめる（0 なら完全一致のみ）。
+        走査・ハッシュ計算はスレッドで行い、その間もイベントループは他のリクエストを処理できる。
+        """
+        return await asyncio.to_thread(DuplicateService._find_similar_images_sync, folder, max_workers, threshold)
+
+    @staticmethod
+    def _find_similar_images_sync(folder: str, max_workers: int, threshold: int) -> List[Dict]:
         duplicates = []
-        
+
         if not os.path.exists(folder):
             raise FileNotFoundError(f"Folder not found: {folder}")
-            
-        filenames = [f for f in os.listdir(folder) if f.lower().endswith((".png", ".jpg", ".jpeg", ".bmp"))]
-        
-        def process_image(filename):
-            try:
-                full_path = Path(os.path.join(folder, filename)).absolute().as_posix()
-                with Image.open(full_path) as img:
-                    img_hash = imagehash.phash(img)
-                    return (img_hash, full_path)
-            except Exception as e:
-                logger.error(f"Failed to process {filename}: {e}")
-                return None
-
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            results = list(executor.map(process_image, filenames))
-
-        # Group by hash
-        for result in results:
-            if result:
-                img_hash, full_path = result
-                if img_hash not in hash_dict:
-                    hash_dict[img_hash] = []
-                hash_dict[img_hash].append({
-                    "path": full_path,
-                    "name": os.path.basename(full_path)
-                })
-        
+
+        with os.scandir(folder) as it:
+            targets = []
+            for e in it:
+                if e.is_file(follow_symlinks=False) and os.path.splitext(e.name)[1].lower() in _IMG_EXT:
+                    st = e.stat(follow_symlinks=False)
+                    targets.append((e.name, Path(e.path).absolute().as_posix(), st.st_size, st.st_mtime_ns))
+
+        conn = open_phash_db()
+        try:
+            cached = {
+                path: (size, mtime_ns, h)
+                for path, size, mtime_ns, h in conn.execute("SELECT path, size, mtime_ns, h FROM phash")
+            }
+
+            # サイズと更新日時が一致する画像はキャッシュ済みのハッシュを使う
+            results = []
+            to_hash = []
+            for filename, full_path, size, mtime_ns in targets:
+                entry = cached.get(full_path)
+                if entry and entry[0] == size and entry[1] == mtime_ns:
+                    results.append((entry[2], full_path))
+                else:
+                    to_hash.append((filename, full_path, size, mtime_ns))
+
+            # pHash の DCT は GIL を握る時間が長いので、スレッドではなくプロセスで並列化する
+            hashed = []
+            if to_hash:
+                with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                    hashed = [r for r in executor.map(_phash_worker, to_hash, chunksize=16) if r]
+
+            conn.executemany(
+                "INSERT OR REPLACE INTO phash (path, size, mtime_ns, h) VALUES (?, ?, ?, ?)",
+                [(full_path, size, mtime_ns, img_hash) for img_hash, full_path, size, mtime_ns in hashed]
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+        results.extend((img_hash, full_path) for img_hash, full_path, _, _ in hashed)
+
+        if not results:
+            return duplicates
+
+        # ハミング距離の近い組を NumPy でまとめて求め、代表画像ごとにグループ化する。
+        # 連結成分でまとめると A~B, B~C だけで A と C（距離は最大 2 * threshold）も同じグループになってしまうので、
+        # 各メンバーは必ずグループの代表（最初の画像）と threshold 以内になるようにする
+        hashes = np.fromiter((int(img_hash, 16) for img_hash, _ in results), dtype=np.uint64, count=len(results))
+        rep: List[Optional[int]] = [None] * len(results)
+
+        # _hamming_pairs は i の昇順に返すので、i を見る時点で i より前の代表は確定している
+        for i, j in zip(*_hamming_pairs(hashes, threshold)):
+            i, j = int(i), int(j)
+            if rep[i] is None:
+                rep[i] = i
+            if rep[i] == i and rep[j] is None:
+                rep[j] = i
+
+        groups: Dict[int, List[int]] = {}
+        for i, r in enumerate(rep):
+            if r is not None:
+                groups.setdefault(r, []).append(i)
+
         # Filter for duplicates (groups with > 1 image)
-        for img_hash, images in hash_dict.items():
-            if len(images) > 1:
+        for root, members in groups.items():
+            if len(members) > 1:
                 duplicates.append({
-                    "hash": str(img_hash),
-                    "images": images
+                    "hash": results[root][0],
+                    "images": [
+                        {"path": results[i][1], "name": os.path.basename(results[i][1])}
+                        for i in members
+                    ]
                 })
-                
+
         return duplicates
 
     @staticmethod
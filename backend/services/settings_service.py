@@ -1,6 +1,23 @@
 import tkinter as tk
 from tkinter import filedialog
 import os
+import re
+import threading
+from typing import Dict
+
+# tk.Tk() の生成は Windows で数百 ms かかるので、非表示のルートを使い回す。
+# Tk のオブジェクトは生成したスレッドからしか触れないため、スレッドも一緒に覚えておく
+_tk_root = None
+_tk_thread_id = None
+
+def _get_tk_root() -> tk.Tk:
+    global _tk_root, _tk_thread_id
+    if _tk_root is None:
+        _tk_root = tk.Tk()
+        _tk_root.withdraw()  # メインウィンドウを非表示にする
+        _tk_root.attributes('-topmost', True)  # ダイアログを最前面に表示
+        _tk_thread_id = threading.get_ident()
+    return _tk_root
 
 class SettingsService:
     @staticmethod
@@ -8,27 +25,44 @@ class SettingsService:
         """
         Windows 標準のフォルダ選択ダイアログを表示する。
         """
-        root = tk.Tk()
-        root.withdraw()  # メインウィンドウを非表示にする
-        root.attributes('-topmost', True)  # ダイアログを最前面に表示
+        if _tk_root is None or _tk_thread_id == threading.get_ident():
+            root = _get_tk_root()
+            owned = False
+        else:
+            # 別スレッドから呼ばれた場合はそのスレッド用に一時的なルートを作る
+            root = tk.Tk()
+            root.withdraw()
+            root.attributes('-topmost', True)
+            owned = True
         
         if not initial_dir or not os.path.exists(initial_dir):
             initial_dir = os.path.expanduser("~")
             
         selected_path = filedialog.askdirectory(
+            parent=root,
             initialdir=initial_dir,
             title="壁紙フォルダを選択してください"
         )
         
-        root.destroy()
+        if owned:
+            root.destroy()
+        else:
+            root.update()  # ダイアログを閉じた後のイベントを処理しておく
         return selected_path
     @staticmethod
     def update_env_variable(key: str, value: str):
         """
         .env ファイルの特定の値を更新し、現在のプロセスにも反映させる。
         """
+        SettingsService.update_env_variables({key: value})
+
+    @staticmethod
+    def update_env_variables(values: Dict[str, str]):
+        """
+        .env ファイルの複数の値を 1 回の読み書きでまとめて更新し、現在のプロセスにも反映させる。
+        """
         # 現在のプロセスに即座に反映
-        os.environ[key] = value
+        os.environ.update(values)
         
         # backend/.env を探す
         backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -36,23 +70,20 @@ class SettingsService:
         if not os.path.exists(env_path):
             # 存在しない場合は作成
             with open(env_path, "w", encoding="utf-8") as f:
-                f.write(f"{key}={value}\n")
+                f.writelines(f"{key}={value}\n" for key, value in values.items())
             return
 
         with open(env_path, "r", encoding="utf-8") as f:
-            lines = f.readlines()
+            text = f.read()
 
-        found = False
-        new_lines = []
-        for line in lines:
-            # key= が含まれている行を探す（先頭の文字化けを考慮）
-            if f"{key}=" in line:
-                new_lines.append(f"{key}={value}\n")
-                found = True
-            else:
-                new_lines.append(line)
-        if not found:
-            new_lines.append(f"{key}={value}\n")
+        for key, value in values.items():
+            # 行頭の key= だけに一致させる（先頭の BOM による文字化けを考慮）
+            pattern = re.compile(rf"^(\ufeff?){re.escape(key)}=.*$", re.MULTILINE)
+            text, n = pattern.subn(lambda m: f"{m.group(1)}{key}={value}", text)
+            if n == 0:
+                if text and not text.endswith("\n"):
+                    text += "\n"
+                text += f"{key}={value}\n"
 
         with open(env_path, "w", encoding="utf-8") as f:
-            f.writelines(new_lines)
+            f.write(text)
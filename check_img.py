@@ -1,31 +1,107 @@
 import os
 import argparse
+import threading
+from functools import lru_cache
 from PIL import Image, ImageTk
 import tkinter as tk
 from tkinter import messagebox
-import imagehash
 from tqdm import tqdm
+from pathlib import Path
+from backend.services.duplicate_service import open_phash_db, phash_hex
+
+DEFAULT_THRESHOLD = 6  # pHash のハミング距離がこの値以下なら類似画像とみなす
+PREVIEW_SIZE = (400, 400)  # プレビューの最大サイズ
+
+# ====== ハミング距離の BK-tree ======
+class BKTree:
+    """ハミング距離で近傍検索するための BK-tree。1 件の検索が全件比較より大幅に少ない比較で済む"""
+    def __init__(self):
+        self.root = None  # (hash, path, {距離: 子ノード})
+    
+    def add(self, h, path):
+        if self.root is None:
+            self.root = (h, path, {})
+            return
+        node = self.root
+        while True:
+            d = (h ^ node[0]).bit_count()
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = (h, path, {})
+                return
+            node = child
+    
+    def find_nearest(self, h, threshold):
+        """距離 threshold 以内で最も近い (距離, path) を返す。無ければ None"""
+        best = None
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            d = (h ^ node[0]).bit_count()
+            if d <= threshold and (best is None or d < best[0]):
+                best = (d, node[1])
+            # 三角不等式から、子の距離が d - threshold 〜 d + threshold の枝だけ調べればよい
+            for child_d, child in node[2].items():
+                if d - threshold <= child_d <= d + threshold:
+                    stack.append(child)
+        return best
 
 # ====== 類似画像の検出 ======
-def find_similar_images(folder):
-    hash_dict = {}
+def find_similar_images(folder, threshold=DEFAULT_THRESHOLD):
+    tree = BKTree()
     duplicates = []
     
-    filenames = [f for f in os.listdir(folder) if f.lower().endswith((".png", ".jpg", ".jpeg", ".bmp"))]
+    # scandir の DirEntry は name / path を持っているので、listdir + join より syscall と文字列生成が少ない
+    with os.scandir(folder) as it:
+        entries = [e for e in it if e.is_file() and e.name.lower().endswith((".png", ".jpg", ".jpeg", ".bmp"))]
     
-    for filename in tqdm(filenames, desc="画像処理中"):
-        full_path = os.path.join(folder, filename)
-        try:
-            img = Image.open(full_path)
-            img_hash = imagehash.phash(img)
-            if img_hash in hash_dict:
-                duplicates.append((hash_dict[img_hash], full_path))
-            else:
-                hash_dict[img_hash] = full_path
-        except Exception as e:
-            tqdm.write(f"Failed to process {filename}: {e}")
+    # バックエンドと同じ pHash キャッシュを使い、(path, size, mtime) が変わらない画像はデコードしない
+    conn = open_phash_db()
+    try:
+        for entry in tqdm(entries, desc="画像処理中"):
+            filename, full_path = entry.name, entry.path
+            try:
+                img_hash = _cached_phash(conn, entry)
+                nearest = tree.find_nearest(img_hash, threshold)
+                if nearest:
+                    duplicates.append((nearest[1], full_path))
+                else:
+                    tree.add(img_hash, full_path)
+            except Exception as e:
+                tqdm.write(f"Failed to process {filename}: {e}")
+        conn.commit()
+    finally:
+        conn.close()
     return duplicates
 
+def _cached_phash(conn, entry):
+    key = Path(entry.path).absolute().as_posix()
+    st = entry.stat()
+    row = conn.execute(
+        "SELECT h FROM phash WHERE path = ? AND size = ? AND mtime_ns = ?", (key, st.st_size, st.st_mtime_ns)
+    ).fetchone()
+    if row:
+        return int(row[0], 16)
+    
+    with Image.open(entry.path) as img:
+        img.draft("L", (64, 64))  # JPEG は縮小デコードで十分（pHash は 32x32 に縮小する）
+        img_hash = phash_hex(img)
+    conn.execute(
+        "INSERT OR REPLACE INTO phash (path, size, mtime_ns, h) VALUES (?, ?, ?, ?)",
+        (key, st.st_size, st.st_mtime_ns, img_hash)
+    )
+    return int(img_hash, 16)
+
+# ====== プレビュー画像の読み込み ======
+@lru_cache(maxsize=8)
+def _load_thumbnail(path):
+    """縮小済みの PIL 画像を返す。PhotoImage は Tk のスレッドでしか作れないので、ここでは PIL 画像までをキャッシュする"""
+    with Image.open(path) as img:
+        img.draft("RGB", PREVIEW_SIZE)  # 4K の JPEG も縮小デコードで十分
+        img.thumbnail(PREVIEW_SIZE)
+        img.load()
+        return img.copy()
+
 # ====== UI の表示クラス ======
 class DuplicateViewer:
     def __init__(self, root, duplicates):
@@ -55,10 +131,23 @@ class DuplicateViewer:
         
         self.show_pair()
     
-    def resize_image(self, path, maxsize=(400, 400)):
-        img = Image.open(path)
-        img.thumbnail(maxsize)
-        return ImageTk.PhotoImage(img)
+    def resize_image(self, path):
+        # 先読みと同じ引数で呼ぶこと（lru_cache は引数の渡し方ごとに別のキーになる）
+        return ImageTk.PhotoImage(_load_thumbnail(path))
+    
+    def _prefetch(self, index):
+        """次のペアを裏で読み込んでおき、ボタンを押した直後に表示できるようにする"""
+        if index >= len(self.duplicates):
+            return
+        
+        def load():
+            for path in self.duplicates[index]:
+                try:
+                    _load_thumbnail(path)
+                except Exception:
+                    pass  # 表示時に改めてエラーを出す
+        
+        threading.Thread(target=load, daemon=True).start()
     
     def show_pair(self):
         if self.index >= len(self.duplicates):
@@ -75,6 +164,7 @@ class DuplicateViewer:
             self.label1.config(image=self.img1)
             self.label2.config(image=self.img2)
             self.root.title(f"{os.path.basename(left)} vs {os.path.basename(right)}")
+            self.root.after(10, self._prefetch, self.index + 1)
         except Exception as e:
             messagebox.showerror("エラー", f"画像を開けません: {e}")
             self.index += 1
@@ -97,6 +187,7 @@ def main():
     print("スクリプト開始")
     parser = argparse.ArgumentParser(description="重複画像を見つけて手動で削除")
     parser.add_argument("folder", help="画像が入っているフォルダのパス")
+    parser.add_argument("--threshold", type=int, default=DEFAULT_THRESHOLD, help="類似とみなす pHash のハミング距離 (0 で完全一致のみ)")
     args = parser.parse_args()
     
     folder_path = args.folder
@@ -107,7 +198,7 @@ def main():
         return
     
     print("重複画像を検出中...")
-    duplicates = find_similar_images(folder_path)
+    duplicates = find_similar_images(folder_path, args.threshold)
     print(f"見つかった重複数: {len(duplicates)}")
     
     if not duplicates:
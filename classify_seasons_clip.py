@@ -1,14 +1,18 @@
 import os
 import sys
+import csv
+import gc
 import logging
 import time
+from collections import Counter
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
-from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
 
 import numpy as np
 import pandas as pd
 import torch
+import torch.nn.functional as F
 from PIL import Image, ImageDraw, ImageFont
 from tqdm import tqdm
 from transformers import CLIPProcessor, CLIPModel
@@ -16,22 +20,55 @@ import matplotlib.pyplot as plt
 import argparse
 import shutil
 
-# ロギング設定
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("season_classifier.log", mode="w", encoding="utf-8")
-    ]
-)
+try:
+    # torchvision があれば、GPU では JPEG を nvJPEG でデバイス上に直接デコードする
+    from torchvision.io import ImageReadMode, decode_jpeg, read_file
+except ImportError:
+    decode_jpeg = None
+
+try:
+    # numba があれば、不確実性スコアを JIT コンパイルした 1 パスのループで計算する（なければ NumPy で計算する）
+    from _metrics_numba import compute_metrics
+except ImportError:
+    compute_metrics = None
+
+try:
+    from scipy.special import xlogy
+except ImportError:
+    def xlogy(x, y):
+        """scipy.special.xlogy と同じく x * log(y) を返し、x == 0 の要素は 0 にする"""
+        return np.where(x == 0, 0, x * np.log(np.where(x == 0, 1, y)))
+
 logger = logging.getLogger(__name__)
 
+# ロギング設定
+def setup_logging():
+    # 分類処理のワーカープロセスがこのモジュールを import し直してもログファイルを上書きしないよう、
+    # 設定はスクリプトとして実行されたときだけ行う
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(),
+            logging.FileHandler("season_classifier.log", mode="w", encoding="utf-8")
+        ]
+    )
+
 # === 設定 ===
 DEFAULT_IMAGE_FOLDER = "./images"
 DESKTOP = os.path.join(os.environ.get("USERPROFILE", os.path.expanduser("~")), "Desktop")
 DEFAULT_OUTPUT_FOLDER = f"{DESKTOP}/classified_images"
 BASE_CSV_NAME = "clip_season_analysis.csv"  # 基本的な分析結果を保存する CSV
+BATCH_SIZE = 32  # 1 回の CLIP forward にまとめる画像数
+JPEG_EXTENSIONS = (".jpg", ".jpeg")  # nvJPEG でデコードできる拡張子（PNG は PIL で読み込む）
+SAVE_OPTIONS = {"quality": 85, "optimize": False}  # JPEG 保存時の画質。最適化のための 2 パス目は行わない（PNG では quality は無視される）
+PROB_COLUMNS = ["spring", "summer", "autumn", "winter"]  # SEASON_LABELS と同じ順
+UNCERTAINTY_COLUMNS = ["least_confidence", "margin_confidence", "ratio_confidence", "entropy"]
+ANALYSIS_COLUMNS = ["filename", "predicted_label", *PROB_COLUMNS, *UNCERTAINTY_COLUMNS]  # analyze_batch が返す辞書のキー（CSV の列順）
+CLASSIFICATION_COLUMNS = [
+    "filename", "predicted_label", "classified_folder", "is_uncertain",
+    "uncertainty_value", "uncertainty_metric", "uncertainty_threshold"
+]  # classify_single_image が返す辞書のキー（分類結果 CSV の列順）
 
 SEASON_LABELS = [
     "a photo of spring",
@@ -72,10 +109,70 @@ def load_model():
     device = "cuda" if torch.cuda.is_available() else "cpu"
     model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32").to(device)
     processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32", use_fast=False)
+    model.eval()
+    if device == "cuda":
+        # 学習はしないので GPU では FP16 の重みで推論する（softmax は FP32 に戻してから行う）
+        model = model.half()
+        # 入力サイズは常に 224x224 なので、cuDNN に最速の畳み込みアルゴリズムを選ばせる
+        # （ViT のパッチ埋め込みの畳み込みは NHWC の方が Tensor Core を使いやすい）
+        torch.backends.cudnn.benchmark = True
+        model = model.to(memory_format=torch.channels_last)
+        compile_vision_model(model, processor, device)
+    text_features = encode_text_features(model, processor, device)
     
     elapsed_time = time.time() - start_time
     logger.info(f"デバイス: {device}, モデルを読み込みました。(所要時間: {elapsed_time:.2f}秒)")
-    return model, processor, device
+    return model, processor, device, text_features
+
+# === 画像エンコーダをコンパイルする関数 ===
+def compile_vision_model(model, processor, device):
+    """
+    画像エンコーダを torch.compile（CUDA グラフ）でコンパイルする関数
+    入力は常に (BATCH_SIZE, 3, 224, 224) なので、グラフは 1 回だけキャプチャされる
+    コンパイルは初回呼び出し時に走るので、ダミー入力を流してここでコストを払う
+    失敗した場合（Triton が無い環境など）は通常の forward に戻す
+    """
+    eager_vision_model = model.vision_model
+    try:
+        model.vision_model = torch.compile(eager_vision_model, mode="reduce-overhead")
+        size = processor.image_processor.crop_size["height"]
+        dummy = torch.zeros(BATCH_SIZE, 3, size, size, device=device, dtype=model.dtype)
+        with torch.inference_mode():
+            # 1 回目はウォームアップ、2 回目で CUDA グラフが記録される
+            # （分析中は別スレッドが次のバッチを GPU 上で前処理するので、記録はここで済ませておく）
+            for _ in range(2):
+                model.get_image_features(pixel_values=dummy.to(memory_format=torch.channels_last))
+    except Exception as e:
+        logger.warning(f"torch.compile が使えないため、通常の画像エンコーダを使用します: {e}")
+        model.vision_model = eager_vision_model
+
+# === 季節ラベルのテキスト埋め込みを計算する関数 ===
+def encode_text_features(model, processor, device):
+    """
+    SEASON_LABELS のテキスト埋め込みを計算する関数
+    ラベルは固定なので、モデル読み込み時に 1 回だけ計算して使い回す
+    
+    Returns:
+        Tensor: L2 正規化済みのテキスト埋め込み (4, D)
+    """
+    text_inputs = processor(text=SEASON_LABELS, return_tensors="pt", padding=True).to(device)
+    with torch.inference_mode():
+        text_features = model.get_text_features(**text_inputs)
+    return F.normalize(text_features.float(), dim=-1)
+
+# === 画像埋め込みとテキスト埋め込みから確率を計算する関数 ===
+def season_probs(model, pixel_values, text_features):
+    """
+    画像エンコーダだけを実行し、キャッシュ済みのテキスト埋め込みとの類似度から確率を計算する関数
+    
+    Returns:
+        Tensor: 確率 (N, 4)（デバイス上）
+    """
+    pixel_values = pixel_values.to(dtype=model.dtype, memory_format=torch.channels_last)
+    image_features = model.get_image_features(pixel_values=pixel_values)
+    image_features = F.normalize(image_features.float(), dim=-1)
+    logits = model.logit_scale.exp() * image_features @ text_features.T
+    return logits.softmax(dim=-1)
 
 # === 不確実性スコア計算関数 ===
 def calculate_uncertainty_scores(probs):
@@ -83,27 +180,35 @@ def calculate_uncertainty_scores(probs):
     不確実性スコアを計算する関数
     
     Args:
-        probs: 確率分布の配列
+        probs: 確率分布の配列。(4,) なら 1 枚分、(N, 4) なら N 枚分をまとめて計算する
         
     Returns:
-        dict: 各種不確実性スコア
+        dict: 各種不確実性スコア（(N, 4) を渡した場合は長さ N の配列）
     """
-    # ソートした確率分布
-    sorted_probs = np.sort(probs)[::-1]
+    # CLIP の出力は FP16/FP32 なので、FP64 に広げずに FP32 のまま計算する
+    probs = np.ascontiguousarray(probs, dtype=np.float32)
+    if compute_metrics is not None and probs.ndim == 2:
+        scores = np.empty_like(probs, shape=(len(probs), len(UNCERTAINTY_COLUMNS)))
+        compute_metrics(probs, scores)
+        return dict(zip(UNCERTAINTY_COLUMNS, scores.T))
+    
+    # 最後の軸で 1 回だけソートし、上位 2 つの確率を取り出す
+    sorted_probs = np.sort(probs, axis=-1)
+    top1 = sorted_probs[..., -1]
+    top2 = sorted_probs[..., -2]
     
     # 1. 最小確信度 (1 - 最大確率)
-    least_confidence = 1.0 - sorted_probs[0]
+    least_confidence = 1.0 - top1
     
     # 2. 確信度マージン (最大確率 - ２番目の確率)
-    margin_confidence = sorted_probs[0] - sorted_probs[1]
+    margin_confidence = top1 - top2
     
     # 3. 確信度比率 (２番目の確率 / 最大確率)
-    ratio_confidence = sorted_probs[1] / sorted_probs[0] if sorted_probs[0] > 0 else 1.0
+    ratio_confidence = np.where(top1 > 0, top2 / np.where(top1 > 0, top1, 1.0), 1.0)[()]
     
     # 4. エントロピー
-    # 0 の確率がある場合は log(0) を避けるための小さな値を追加
-    epsilon = 1e-10
-    entropy = -np.sum(probs * np.log(probs + epsilon))
+    # xlogy は p = 0 の項を 0 として扱うので、log(0) を避けるための小さな値を足す必要がない
+    entropy = -xlogy(probs, probs).sum(axis=-1)
     
     return {
         "least_confidence": least_confidence,
@@ -132,46 +237,39 @@ def is_uncertain(value, metric, threshold):
         # 他の指標は大きいほど不確実
         return value > threshold
 
-# === 分類処理 ===
-def analyze_image(image_path, model, processor, device):
+# === 全画像の不確実性をまとめて判定する関数 ===
+def uncertainty_mask(df, metric, threshold):
     """
-    画像を分析し、季節を予測する関数
+    分析結果の全画像について、不確実かどうかを 1 回の比較でまとめて判定する関数
+    結果は df["is_uncertain"] に入れて、分類・診断・統計表示で使い回す
     
-    Args:
-        image_path: 画像ファイルのパス
-        model: CLIPモデル
-        processor: CLIPプロセッサ
-        device: 計算デバイス
-        
     Returns:
-        tuple: (画像, 予測ラベル, 確率, 不確実性スコア)
+        ndarray: 画像ごとの判定結果 (bool)
     """
-    try:
-        image = Image.open(image_path).convert("RGB")
-    except FileNotFoundError:
-        logger.error(f"画像ファイルが見つかりません: {image_path}")
-        return None, None, None, None
-    except PermissionError:
-        logger.error(f"画像ファイルにアクセスできません: {image_path}")
-        return None, None, None, None
-    except Exception as e:
-        logger.error(f"画像の読み込みに失敗しました: {image_path} ({e})")
-        return None, None, None, None
+    return is_uncertain(df[metric].to_numpy(), metric, threshold)
+
+# === 閾値ごとの不確実な画像数を数える関数 ===
+def count_uncertain(values, metric, thresholds):
+    """
+    複数の閾値それぞれについて、不確実と判定される画像数を数える関数
+    値を 1 回ソートして二分探索するので、閾値ごとに全件を比較し直さない
     
-    try:
-        inputs = processor(text=SEASON_LABELS, images=image, return_tensors="pt", padding=True).to(device)
-        with torch.no_grad():  # 推論時は勾配計算不要
-            outputs = model(**inputs)
-        probs = outputs.logits_per_image.softmax(dim=1).detach().cpu().numpy()[0]
-        top_idx = probs.argmax()
-        
-        # 不確実性スコアを計算
-        uncertainty_scores = calculate_uncertainty_scores(probs)
+    Args:
+        values: 不確実性の値の配列
+        metric: 不確実性の指標
+        thresholds: 閾値の配列
         
-        return image, SEASON_LABELS[top_idx], probs, uncertainty_scores
-    except Exception as e:
-        logger.error(f"画像の分析に失敗しました: {image_path} ({e})")
-        return None, None, None, None
+    Returns:
+        ndarray: 閾値ごとの不確実な画像数
+    """
+    values = np.asarray(values, dtype=np.float64)
+    sorted_values = np.sort(values[~np.isnan(values)])
+    if metric == "margin_confidence":
+        # margin_confidence は小さいほど不確実: value < threshold の個数
+        return np.searchsorted(sorted_values, thresholds, side="left")
+    else:
+        # 他の指標は大きいほど不確実: value > threshold の個数
+        return len(sorted_values) - np.searchsorted(sorted_values, thresholds, side="right")
 
 # === 画像に情報を追加する関数 ===
 def add_text_to_image(image, label, probs, uncertainty_scores, uncertainty_metric):
@@ -223,9 +321,22 @@ def add_text_to_image(image, label, probs, uncertainty_scores, uncertainty_metri
     return new_image
 
 # === フォントを取得する関数 ===
+# 日本語フォントのパスを指定（環境によって異なる）
+FONT_PATHS = [
+    '/System/Library/Fonts/ヒラギノ角ゴシック W4.ttc',  # macOS
+    '/usr/share/fonts/truetype/fonts-japanese-gothic.ttf',  # Ubuntu
+    'C:/Windows/Fonts/meiryo.ttc',  # Windows
+    'C:/Windows/Fonts/msgothic.ttc',  # Windows
+    '/usr/share/fonts/truetype/ipafont/ipagp.ttf',  # Linux
+]
+# 存在するフォントの探索は起動時に 1 回だけ行う
+_FONT_PATH = next((p for p in FONT_PATHS if os.path.exists(p)), None)
+
+@lru_cache(maxsize=8)
 def get_font(size=16):
     """
     システムにインストールされている日本語フォントを取得する関数
+    サイズごとにフォントオブジェクトをキャッシュし、画像ごとにファイルを開き直さない
     
     Args:
         size: フォントサイズ
@@ -233,20 +344,11 @@ def get_font(size=16):
     Returns:
         ImageFont: フォントオブジェクト
     """
-    # 日本語フォントのパスを指定（環境によって異なる）
-    font_paths = [
-        '/System/Library/Fonts/ヒラギノ角ゴシック W4.ttc',  # macOS
-        '/usr/share/fonts/truetype/fonts-japanese-gothic.ttf',  # Ubuntu
-        'C:/Windows/Fonts/meiryo.ttc',  # Windows
-        'C:/Windows/Fonts/msgothic.ttc',  # Windows
-        '/usr/share/fonts/truetype/ipafont/ipagp.ttf',  # Linux
-    ]
-    
-    for path in font_paths:
+    if _FONT_PATH:
         try:
-            return ImageFont.truetype(path, size)
-        except:
-            continue
+            return ImageFont.truetype(_FONT_PATH, size)
+        except OSError:
+            pass
     
     # フォントが見つからない場合はデフォルトフォントを使用
     return ImageFont.load_default()
@@ -283,9 +385,10 @@ def update_folder_names(output_folder, folder_counts):
     
     Args:
         output_folder: 出力フォルダのパス
-        folder_counts: フォルダごとの画像数
+        folder_counts: フォルダごとの画像数（Counter。画像が無いフォルダは 0）
     """
-    for folder_name, count in folder_counts.items():
+    for folder_name in SEASON_FOLDERS.values():
+        count = folder_counts[folder_name]
         old_path = os.path.join(output_folder, folder_name)
         new_folder_name = f"{folder_name} ({count})"
         new_path = os.path.join(output_folder, new_folder_name)
@@ -322,79 +425,272 @@ def analyze_images(image_folder, base_output_folder, force_recalculate=False, ma
         return pd.read_csv(csv_path)
     
     # モデルを読み込む
-    model, processor, device = load_model()
+    model, processor, device, text_features = load_model()
     
     # 出力フォルダの作成（なければ）
     os.makedirs(base_output_folder, exist_ok=True)
     
     # 画像ファイルの取得
-    image_files = [f for f in os.listdir(image_folder) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    with os.scandir(image_folder) as it:
+        image_entries = [e for e in it if e.is_file() and e.name.lower().endswith(('.jpg', '.jpeg', '.png'))]
     
-    if not image_files:
+    if not image_entries:
         logger.warning(f"画像ファイルが見つかりません: {image_folder}")
         return None
     
-    logger.info(f"{len(image_files)} 枚の画像を分析しています...")
-    
-    results = []
-    
-    # 画像分析関数をパーシャル適用して並列処理用に準備
-    analyze_func = partial(analyze_single_image, 
-                          image_folder=image_folder, 
-                          model=model, 
-                          processor=processor, 
-                          device=device)
+    logger.info(f"{len(image_entries)} 枚の画像を分析しています...")
     
-    # 並列処理で画像を分析
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        for result in tqdm(executor.map(analyze_func, image_files), total=len(image_files)):
-            if result is not None:
-                results.append(result)
+    n_results = 0
     
-    # 結果をCSVに保存
-    if results:
-        df = pd.DataFrame(results)
-        df.to_csv(csv_path, index=False)
-        
+    # BATCH_SIZE 枚ずつまとめて 1 回の forward で分析し、結果はバッチごとに CSV へ書き出す（リストに溜めない）
+    # 画像の読み込みは I/O 待ちが中心なのでスレッドで並列化し、次のバッチの読み込みは推論中に先に進めておく
+    # 途中で中断されると書きかけの CSV が次回キャッシュとして読まれてしまうので、一時ファイルに書いて最後に置き換える
+    tmp_path = csv_path + ".part"
+    batches = [image_entries[start:start + BATCH_SIZE] for start in range(0, len(image_entries), BATCH_SIZE)]
+    try:
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=ANALYSIS_COLUMNS)
+            writer.writeheader()
+            with ThreadPoolExecutor(max_workers=max_workers) as executor, tqdm(total=len(image_entries)) as pbar:
+                for batch_files, loaded_files, pixel_values in iter_pixel_values(batches, processor, device, executor):
+                    results = analyze_batch(batch_files, loaded_files, pixel_values, model, device, text_features)
+                    writer.writerows(results)
+                    n_results += len(results)
+                    pbar.update(len(batch_files))
+    except BaseException:
+        # Ctrl+C も含めて、書きかけの一時ファイルは残さない
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    
+    # 分類処理は CPU だけで行うので、モデルと GPU のメモリはここで解放する
+    del model, processor, text_features
+    release_model_memory(device)
+    
+    if n_results:
+        os.replace(tmp_path, csv_path)
         logger.info(f"\n✅ 分析完了！結果は {csv_path.replace('\\', '/')} に保存されました")
-        return df
+        return pd.read_csv(csv_path)
     else:
+        # 結果が無い CSV を残すと次回キャッシュとして読まれてしまうので、置き換えずに削除する
+        os.remove(tmp_path)
         logger.warning("分析結果がありません。")
         return None
 
-# === 単一画像を分析する関数（並列処理用） ===
-def analyze_single_image(filename, image_folder, model, processor, device):
+# === 分析後にモデルのメモリを解放する関数 ===
+def release_model_memory(device):
+    """
+    analyze_images でモデルを使い終わった後に、転送用のピン留めバッファと
+    PyTorch のキャッシングアロケータが確保したままの GPU メモリを解放する関数
+    （モデル本体への参照は呼び出し側で del しておく）
+    """
+    global _pinned_out
+    _pinned_in[:] = [None, None]
+    _pinned_out = None
+    gc.collect()
+    if device == "cuda":
+        torch.compiler.reset()  # コンパイル済みグラフ（CUDA グラフのメモリプール）への参照を捨てる
+        torch.cuda.empty_cache()
+        torch.cuda.ipc_collect()
+
+# === デバイス上の結果を CPU に転送する関数 ===
+_pinned_out = None  # CUDA → CPU 転送用に使い回すピン留めバッファ
+
+def copy_to_host(tensor):
+    """
+    float32 のテンソルを NumPy 配列にする関数
+    CUDA ではピン留めバッファに非同期でコピーし、同期はバッチごとに 1 回だけ行う
+    """
+    global _pinned_out
+    if tensor.device.type != "cuda":
+        return tensor.numpy()
+    
+    n = tensor.numel()
+    if _pinned_out is None or _pinned_out.numel() < n:
+        _pinned_out = torch.empty(n, dtype=torch.float32, pin_memory=True)
+    out = _pinned_out[:n].view(tensor.shape)
+    out.copy_(tensor, non_blocking=True)
+    torch.cuda.current_stream(tensor.device).synchronize()
+    return out.numpy().copy()  # バッファは次のバッチで上書きされるのでコピーを返す
+
+# === CPU で前処理した入力をデバイスに転送する関数 ===
+_pinned_in = [None, None]  # CPU → CUDA 転送用に交互に使うピン留めバッファ
+_pinned_in_index = 0
+
+def copy_to_device(tensor, device):
+    """
+    float32 のテンソルをデバイスに転送する関数
+    CUDA では毎回ページング可能なメモリから転送せず、ピン留めバッファを経由して非同期に転送する
+    次のバッチは推論中に先読みされるので、バッファは 2 つを交互に使う
+    （2 つ前のバッチの転送は、その推論後の copy_to_host の同期で完了しているので上書きしても安全）
+    """
+    global _pinned_in_index
+    if device != "cuda":
+        return tensor
+    
+    n = tensor.numel()
+    _pinned_in_index ^= 1
+    if _pinned_in[_pinned_in_index] is None or _pinned_in[_pinned_in_index].numel() < n:
+        # 最初から BATCH_SIZE 枚分を確保し、バッチごとに確保し直さない
+        _pinned_in[_pinned_in_index] = torch.empty(max(n, BATCH_SIZE * tensor[0].numel()), dtype=torch.float32, pin_memory=True)
+    buf = _pinned_in[_pinned_in_index][:n].view(tensor.shape)
+    buf.copy_(tensor)
+    return buf.to(device, non_blocking=True)
+
+# === 画像を読み込む関数（並列処理用） ===
+def load_image(image_path):
     """
-    単一の画像を分析する関数（並列処理用）
+    画像を RGB で読み込む関数。読み込めない場合は None を返す
+    """
+    try:
+        return Image.open(image_path).convert("RGB")
+    except FileNotFoundError:
+        logger.error(f"画像ファイルが見つかりません: {image_path}")
+    except PermissionError:
+        logger.error(f"画像ファイルにアクセスできません: {image_path}")
+    except Exception as e:
+        logger.error(f"画像の読み込みに失敗しました: {image_path} ({e})")
+    return None
+
+# === nvJPEG でデコードした画像を前処理する関数 ===
+def preprocess_on_device(images, processor):
+    """
+    デバイス上の uint8 画像 (3, H, W) のリストに、CLIPProcessor と同じ前処理
+    （短辺を bicubic でリサイズ → 中央切り抜き → 正規化）をテンソル演算で行う関数
+    
+    Returns:
+        Tensor: pixel_values (N, 3, 224, 224)（デバイス上）
+    """
+    image_processor = processor.image_processor
+    size = image_processor.crop_size["height"]
+    crops = []
+    for img in images:
+        img = img.unsqueeze(0).float() / 255.0
+        h, w = img.shape[-2:]
+        scale = size / min(h, w)
+        img = F.interpolate(img, size=(max(size, round(h * scale)), max(size, round(w * scale))), mode="bicubic", antialias=True)
+        top = (img.shape[-2] - size) // 2
+        left = (img.shape[-1] - size) // 2
+        crops.append(img[..., top:top + size, left:left + size])
+    batch = torch.cat(crops).clamp_(0.0, 1.0)
+    mean = torch.tensor(image_processor.image_mean, device=batch.device).view(1, -1, 1, 1)
+    std = torch.tensor(image_processor.image_std, device=batch.device).view(1, -1, 1, 1)
+    return (batch - mean) / std
+
+# === バッチの画像を読み込んで CLIP の入力にする関数 ===
+def load_pixel_values(filenames, image_paths, processor, device, executor):
+    """
+    バッチの画像を読み込み、CLIP の入力テンソルにする関数
+    GPU では JPEG を nvJPEG でまとめてデバイス上にデコードし、PNG やデコードに失敗したものは PIL で読み込む
+    
+    Returns:
+        tuple: (読み込めた画像のファイル名のリスト, pixel_values (N, 3, 224, 224)（デバイス上）)
+    """
+    pixel_values = [None] * len(image_paths)
+    
+    if decode_jpeg is not None and device == "cuda":
+        jpeg_indices = [i for i, path in enumerate(image_paths) if path.lower().endswith(JPEG_EXTENSIONS)]
+        if jpeg_indices:
+            try:
+                # ファイルの読み込みは I/O 待ちなのでスレッドで並列化し、デコードはバッチ単位で nvJPEG に渡す
+                data = list(executor.map(read_file, [image_paths[i] for i in jpeg_indices]))
+                decoded = decode_jpeg(data, mode=ImageReadMode.RGB, device=device)
+                for i, values in zip(jpeg_indices, preprocess_on_device(decoded, processor)):
+                    pixel_values[i] = values
+            except Exception as e:
+                # 壊れた JPEG が混ざっている場合などはバッチごと PIL に任せる（失敗した画像はそこでログに出る）
+                logger.debug(f"nvJPEG でのデコードに失敗したため PIL で読み込みます: {filenames[0]} ほか ({e})")
+                pixel_values = [None] * len(image_paths)
+    
+    pil_indices = [i for i, values in enumerate(pixel_values) if values is None]
+    images = list(executor.map(load_image, [image_paths[i] for i in pil_indices]))
+    loaded = [(i, image) for i, image in zip(pil_indices, images) if image is not None]
+    if loaded:
+        # テキスト側はキャッシュ済みなので、画像だけを前処理する
+        inputs = processor(images=[image for _, image in loaded], return_tensors="pt")
+        for (i, _), values in zip(loaded, copy_to_device(inputs["pixel_values"], device)):
+            pixel_values[i] = values
+    
+    keep = [i for i, values in enumerate(pixel_values) if values is not None]
+    if not keep:
+        return [], None
+    return [filenames[i] for i in keep], torch.stack([pixel_values[i] for i in keep])
+
+# === バッチの読み込みを推論と重ねる関数 ===
+def iter_pixel_values(batches, processor, device, executor):
+    """
+    バッチごとに (ファイル名のリスト, 読み込めた画像のファイル名のリスト, pixel_values) を順に返すジェネレータ
+    次のバッチの読み込み・前処理を別スレッドで先に始めておき、呼び出し側の GPU の推論と重ねる
     
     Args:
-        filename: 画像ファイル名
-        image_folder: 入力画像フォルダのパス
-        model: CLIPモデル
+        batches: os.DirEntry のリストのリスト
         processor: CLIPプロセッサ
         device: 計算デバイス
+        executor: 画像の読み込みに使う ThreadPoolExecutor
+    """
+    def load(batch_entries):
+        filenames = [e.name for e in batch_entries]
+        try:
+            return filenames, *load_pixel_values(filenames, [e.path for e in batch_entries], processor, device, executor)
+        except Exception as e:
+            logger.error(f"画像の読み込みに失敗しました: {filenames[0]} ほか {len(filenames)} 枚 ({e})")
+            return filenames, [], None
+    
+    if not batches:
+        return
+    with ThreadPoolExecutor(max_workers=1) as producer:
+        pending = producer.submit(load, batches[0])
+        for next_batch in batches[1:]:
+            current = pending.result()
+            pending = producer.submit(load, next_batch)
+            yield current
+        yield pending.result()
+
+# === 複数画像をまとめて分析する関数 ===
+def analyze_batch(filenames, loaded_files, pixel_values, model, device, text_features):
+    """
+    複数の画像を 1 回の forward でまとめて分析する関数
+    
+    Args:
+        filenames: バッチの画像ファイル名のリスト（ログ用）
+        loaded_files: 読み込めた画像のファイル名のリスト
+        pixel_values: 読み込めた画像の CLIP の入力 (N, 3, 224, 224)（デバイス上）
+        model: CLIPモデル
+        device: 計算デバイス
+        text_features: キャッシュ済みのテキスト埋め込み
         
     Returns:
-        dict: 分析結果
+        list: 分析結果（読み込めなかった画像は含まない）
     """
-    image_path = os.path.join(image_folder, filename)
-    image, label, probs, uncertainty_scores = analyze_image(image_path, model, processor, device)
-    
-    if image is not None:
-        # 結果を記録
-        return {
-            "filename": filename,
-            "predicted_label": label,
-            "spring": probs[0],
-            "summer": probs[1],
-            "autumn": probs[2],
-            "winter": probs[3],
-            "least_confidence": uncertainty_scores["least_confidence"],
-            "margin_confidence": uncertainty_scores["margin_confidence"],
-            "ratio_confidence": uncertainty_scores["ratio_confidence"],
-            "entropy": uncertainty_scores["entropy"]
-        }
-    return None
+    if not loaded_files:
+        return []
+    try:
+        n = len(loaded_files)
+        if device == "cuda" and n < BATCH_SIZE:
+            # CUDA グラフを撮り直さないよう、端数のバッチはゼロ埋めして BATCH_SIZE 枚にそろえる（結果は先頭 n 枚だけ使う）
+            pixel_values = F.pad(pixel_values, (0, 0, 0, 0, 0, 0, 0, BATCH_SIZE - n))
+        with torch.inference_mode():  # 推論のみなので勾配・バージョン管理は不要
+            probs_t = season_probs(model, pixel_values, text_features)[:n]
+            # 予測クラスもデバイス上で求め、バッチ全体をまとめて 1 回だけ CPU に転送する
+            top_idx_t = probs_t.argmax(dim=-1, keepdim=True).to(probs_t.dtype)
+            packed = copy_to_host(torch.cat([probs_t, top_idx_t], dim=-1))
+        probs_batch, top_indices = packed[:, :-1], packed[:, -1].astype(np.intp)
+    except Exception as e:
+        logger.error(f"画像の分析に失敗しました: {filenames[0]} ほか {len(filenames)} 枚 ({e})")
+        return []
+    
+    # 不確実性スコアはバッチ全体 (N, 4) に対してまとめて計算し、列ごとに行へ組み立てる
+    uncertainty_scores = calculate_uncertainty_scores(probs_batch)
+    columns = {
+        "filename": loaded_files,
+        "predicted_label": [SEASON_LABELS[i] for i in top_indices],
+        "spring": probs_batch[:, 0].tolist(),
+        "summer": probs_batch[:, 1].tolist(),
+        "autumn": probs_batch[:, 2].tolist(),
+        "winter": probs_batch[:, 3].tolist(),
+        **{metric: values.tolist() for metric, values in uncertainty_scores.items()}
+    }
+    return [dict(zip(ANALYSIS_COLUMNS, row)) for row in zip(*(columns[col] for col in ANALYSIS_COLUMNS))]
 
 # === CSV から画像を分類する関数 ===
 def classify_images(df, image_folder, base_output_folder, uncertainty_threshold, uncertainty_metric, max_workers=4, annotate=False, annotate_size=None):
@@ -412,7 +708,7 @@ def classify_images(df, image_folder, base_output_folder, uncertainty_threshold,
         annotate_size: --annotate時の出力画像サイズ (例: 1280x720)
         
     Returns:
-        tuple: (出力フォルダのパス, 分類結果のリスト)
+        tuple: (出力フォルダのパス, 分類結果 CSV のパス（結果が無い場合は None）)
     """
     # 出力フォルダの作成
     output_folder = create_output_folders(base_output_folder, uncertainty_metric, uncertainty_threshold)
@@ -420,19 +716,11 @@ def classify_images(df, image_folder, base_output_folder, uncertainty_threshold,
     logger.info(f"{len(df)} 枚の画像を分類しています...")
     logger.info(f"不確実性指標: {uncertainty_metric}, 閾値: {uncertainty_threshold}")
     
-    # 不確実性の判定
-    if uncertainty_metric == "margin_confidence":
-        # margin_confidence は小さいほど不確実
-        df["is_uncertain"] = df[uncertainty_metric] < uncertainty_threshold
-    else:
-        # 他の指標は大きいほど不確実
-        df["is_uncertain"] = df[uncertainty_metric] > uncertainty_threshold
-    
-    # 分類結果を保存するためのリスト
-    classification_results = []
+    # 不確実性の判定（print_statistics でも同じ列を使う）
+    df["is_uncertain"] = uncertainty_mask(df, uncertainty_metric, uncertainty_threshold)
     
-    # フォルダごとの画像数をカウントするための辞書
-    folder_counts = {folder: 0 for folder in SEASON_FOLDERS.values()}
+    # フォルダごとの画像数（分類しながら数える）
+    folder_counts = Counter()
     
     # annotate時は指定サイズ or デフォルトサイズ
     pad_width, pad_height = None, None
@@ -460,42 +748,57 @@ def classify_images(df, image_folder, base_output_folder, uncertainty_threshold,
             pad_width = widths[mid]
             pad_height = heights[mid]
     """
-    # 分類処理関数をパーシャル適用して並列処理用に準備
-    classify_func = partial(classify_single_image, 
-                           df=df, 
-                           image_folder=image_folder, 
-                           output_folder=output_folder, 
-                           uncertainty_metric=uncertainty_metric,
-                           uncertainty_threshold=uncertainty_threshold,
-                           annotate=annotate,
-                           pad_width=pad_width,
-                           pad_height=pad_height)
+    # 必要な列は 1 回だけ NumPy 配列 / リストに取り出し、ワーカーには行ごとの値だけを渡す（pandas の行アクセスをしない）
+    filenames = df["filename"].tolist()
+    labels = df["predicted_label"].tolist()
+    probs_arr = df[PROB_COLUMNS].to_numpy()
+    unc_arr = df[UNCERTAINTY_COLUMNS].to_numpy()
+    is_unc = df["is_uncertain"].tolist()
+    
+    # 全画像で共通の設定は、ワーカーの起動時に 1 回だけ渡す（タスクごとに pickle して送らない）
+    worker_settings = {
+        "image_folder": image_folder,
+        "output_folder": output_folder,
+        "uncertainty_metric": uncertainty_metric,
+        "uncertainty_threshold": uncertainty_threshold,
+        "annotate": annotate,
+        "pad_width": pad_width,
+        "pad_height": pad_height
+    }
     
     # 並列処理で画像を分類
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        filenames = df["filename"].tolist()
-        for result in tqdm(executor.map(classify_func, filenames), total=len(filenames)):
+    # PIL のデコード・エンコードは GIL を握るので、スレッドではなくプロセスで並列化する
+    # （ワーカーには該当行だけを渡し、まとめて送ることでプロセス間通信の回数を減らす）
+    # 分類結果はメモリに溜めず、1 件ずつ CSV に書き出す
+    classification_csv_path = os.path.join(base_output_folder, f"classification_{uncertainty_metric}_{uncertainty_threshold}.csv")
+    with open(classification_csv_path, "w", newline="", encoding="utf-8") as f, \
+            ProcessPoolExecutor(max_workers=max_workers, initializer=init_classify_worker, initargs=(worker_settings,)) as executor:
+        writer = csv.DictWriter(f, fieldnames=CLASSIFICATION_COLUMNS)
+        writer.writeheader()
+        chunksize = max(1, len(filenames) // (max_workers * 4))
+        rows = executor.map(classify_worker, filenames, labels, probs_arr, unc_arr, is_unc, chunksize=chunksize)
+        for result in tqdm(rows, total=len(filenames)):
             if result:
                 classification_result, target_folder = result
-                classification_results.append(classification_result)
+                writer.writerow(classification_result)
                 folder_counts[target_folder] += 1
     
     # フォルダ名を更新（画像数を含める）
     update_folder_names(output_folder, folder_counts)
     
-    # 分類結果を CSV に保存
-    if classification_results:
-        classification_df = pd.DataFrame(classification_results)
-        classification_csv_path = os.path.join(base_output_folder, f"classification_{uncertainty_metric}_{uncertainty_threshold}.csv")
-        classification_df.to_csv(classification_csv_path, index=False)
+    if folder_counts.total():
         logger.info(f"分類結果を保存しました: {classification_csv_path.replace('\\', '/')}" )
+    else:
+        # 1 枚も分類できなかった場合はヘッダだけの CSV を残さない
+        os.remove(classification_csv_path)
+        classification_csv_path = None
     
     # 統計情報の表示
     print_statistics(df, uncertainty_metric, folder_counts, uncertainty_threshold)
     
     logger.info(f"✅ 分類完了！分類された画像は {output_folder.replace('\\', '/')} に保存されました")
     
-    return output_folder, classification_results
+    return output_folder, classification_csv_path
 
 # === unknown に分類された画像を診断する関数 ===
 def diagnose_unknown(df, image_folder, uncertainty_metric, uncertainty_threshold):
@@ -509,13 +812,12 @@ def diagnose_unknown(df, image_folder, uncertainty_metric, uncertainty_threshold
         uncertainty_threshold: 不確実性の閾値
     """
     # 不確実性の判定
-    if uncertainty_metric == "margin_confidence":
-        df["is_uncertain"] = df[uncertainty_metric] < uncertainty_threshold
-    else:
-        df["is_uncertain"] = df[uncertainty_metric] > uncertainty_threshold
+    df["is_uncertain"] = uncertainty_mask(df, uncertainty_metric, uncertainty_threshold)
+    # 予測ラベルの確率（CSV には季節ごとの確率しか無いので最大値を求める）
+    df = df.assign(max_prob=df[PROB_COLUMNS].max(axis=1))
     
     # unknown に分類された画像
-    unknown_df = df[df["is_uncertain"] == True].copy()
+    unknown_df = df[df["is_uncertain"]]
     
     if len(unknown_df) == 0:
         print(f"✅ unknown に分類された画像はありません（閾値: {uncertainty_threshold}）")
@@ -528,12 +830,10 @@ def diagnose_unknown(df, image_folder, uncertainty_metric, uncertainty_threshold
     print(f"{'ファイル名':<50} {'判定':<10} {'確率':<8} {uncertainty_metric:<15}")
     print("-" * 90)
     
-    for idx, row in unknown_df.iterrows():
-        filename = row["filename"]
-        prediction = row["prediction"]
-        max_prob = row["max_prob"]
-        metric_value = row[uncertainty_metric]
-        print(f"{filename:<50} {prediction:<10} {max_prob:<8.4f} {metric_value:<15.4f}")
+    for filename, label, max_prob, metric_value in zip(
+        unknown_df["filename"], unknown_df["predicted_label"], unknown_df["max_prob"], unknown_df[uncertainty_metric]
+    ):
+        print(f"{filename:<50} {SEASON_FOLDERS[label]:<10} {max_prob:<8.4f} {metric_value:<15.4f}")
     
     # 異なる閾値でのシミュレーション
     print(f"\n\n🔍 閾値変更シミュレーション")
@@ -544,12 +844,9 @@ def diagnose_unknown(df, image_folder, uncertainty_metric, uncertainty_threshold
     print(f"{'閾値':<10} {'unknown':<15} {'判定変更画像':<20} {'説明'}")
     print("-" * 70)
     
-    for test_threshold in test_thresholds:
-        if uncertainty_metric == "margin_confidence":
-            test_uncertain = (df[uncertainty_metric] < test_threshold).sum()
-        else:
-            test_uncertain = (df[uncertainty_metric] > test_threshold).sum()
-        
+    test_counts = count_uncertain(df[uncertainty_metric].to_numpy(), uncertainty_metric, test_thresholds)
+    
+    for test_threshold, test_uncertain in zip(test_thresholds, test_counts):
         changed = abs(test_uncertain - len(unknown_df))
         
         if test_threshold == uncertainty_threshold:
@@ -564,13 +861,14 @@ def diagnose_unknown(df, image_folder, uncertainty_metric, uncertainty_threshold
     print(f"{'季節':<15} {'平均確率':<15} {'平均{}'.format(uncertainty_metric):<20}")
     print("-" * 50)
     
+    # 季節ごとに絞り込み直さず、1 回の groupby でまとめて集計する
+    stats = df.groupby("predicted_label", sort=False).agg(
+        avg_prob=("max_prob", "mean"), avg_metric=(uncertainty_metric, "mean")
+    )
     for season_label in SEASON_LABELS:
-        season_name = SEASON_FOLDERS[season_label]
-        season_df = df[df["prediction"] == season_label]
-        if len(season_df) > 0:
-            avg_prob = season_df["max_prob"].mean()
-            avg_metric = season_df[uncertainty_metric].mean()
-            print(f"{season_name:<15} {avg_prob:<15.4f} {avg_metric:<20.4f}")
+        if season_label in stats.index:
+            row = stats.loc[season_label]
+            print(f"{SEASON_FOLDERS[season_label]:<15} {row['avg_prob']:<15.4f} {row['avg_metric']:<20.4f}")
     
     print("\n💡 ヒント: unknown が多い場合は、閾値を上げる（不確実性を高く）ことで減らせます。")
 
@@ -579,6 +877,11 @@ def find_optimal_threshold(df, uncertainty_metric):
     """
     unknown を最小化する最適な閾値を見つける関数
     
+    unknown の数は閾値に対して単調なので（margin_confidence は閾値を上げるほど増え、
+    他の指標は閾値を上げるほど減る）、最小値は必ず探索範囲の端の側にある
+    探索はせず、閾値ごとの unknown 数は表示用に 1 回のソート + 二分探索でまとめて求め、
+    unknown が最小になる最初の閾値（margin_confidence なら 0.0）をそのまま返す
+    
     Args:
         df: 分析結果のデータフレーム
         uncertainty_metric: 不確実性の指標
@@ -587,39 +890,49 @@ def find_optimal_threshold(df, uncertainty_metric):
         tuple: (最適な閾値, unknown の最小数)
     """
     test_thresholds = np.arange(0.0, 1.01, 0.05)
-    best_threshold = 0.5
-    min_unknown_count = len(df)
+    counts = count_uncertain(df[uncertainty_metric].to_numpy(), uncertainty_metric, test_thresholds)
+    # 単調なので argmin（最小値をとる最初の位置）は端、もしくは端と同じ数になる最初の閾値になる
+    best = int(np.argmin(counts))
     
     print(f"\n🔍 最適閾値を探索中...（指標: {uncertainty_metric}）")
     print(f"{'閾値':<10} {'unknown数':<15} {'率':<10}")
     print("-" * 35)
     
-    for threshold in test_thresholds:
-        if uncertainty_metric == "margin_confidence":
-            uncertain = (df[uncertainty_metric] < threshold).sum()
-        else:
-            uncertain = (df[uncertainty_metric] > threshold).sum()
-        
+    for i, (threshold, uncertain) in enumerate(zip(test_thresholds, counts)):
         rate = (uncertain / len(df)) * 100
-        
-        # unknown が最も少ない閾値を記録
-        if uncertain < min_unknown_count:
-            min_unknown_count = uncertain
-            best_threshold = threshold
-        
-        marker = " ← 最適" if uncertain == min_unknown_count else ""
+        marker = " ← 最適" if i == best else ""
         print(f"{threshold:<10.2f} {uncertain:<15} {rate:<10.1f}%{marker}")
     
-    return best_threshold, min_unknown_count
+    return round(float(test_thresholds[best]), 2), int(counts[best])
+
+# === 分類処理のワーカープロセス用の関数 ===
+_worker_settings = {}  # init_classify_worker がワーカープロセスごとに設定する
+
+def init_classify_worker(settings):
+    """
+    ProcessPoolExecutor の initializer。全画像で共通の設定をワーカーのグローバルに保持する
+    （分類処理はモデルを使わないので、ワーカーにモデルは読み込まない）
+    """
+    global _worker_settings
+    _worker_settings = settings
+
+def classify_worker(filename, predicted_label, probs, uncertainty_values, is_uncertain_flag):
+    """
+    ワーカープロセスで 1 枚分の行データを受け取り、classify_single_image を呼ぶ関数
+    """
+    return classify_single_image(filename, predicted_label, probs, uncertainty_values, is_uncertain_flag, **_worker_settings)
 
 # === 単一画像を分類する関数（並列処理用） ===
-def classify_single_image(filename, df, image_folder, output_folder, uncertainty_metric, uncertainty_threshold, annotate=False, pad_width=None, pad_height=None):
+def classify_single_image(filename, predicted_label, probs, uncertainty_values, is_uncertain_flag, image_folder, output_folder, uncertainty_metric, uncertainty_threshold, annotate=False, pad_width=None, pad_height=None):
     """
     単一の画像を分類する関数（並列処理用）
     
     Args:
         filename: 画像ファイル名
-        df: 分析結果のデータフレーム
+        predicted_label: 予測ラベル
+        probs: 季節ごとの確率 (PROB_COLUMNS の順)
+        uncertainty_values: 不確実性スコア (UNCERTAINTY_COLUMNS の順)
+        is_uncertain_flag: 不確実と判定されたかどうか
         image_folder: 入力画像フォルダのパス
         output_folder: 出力フォルダのパス
         uncertainty_metric: 不確実性の指標
@@ -639,14 +952,12 @@ def classify_single_image(filename, df, image_folder, output_folder, uncertainty
             logger.warning(f"警告: 画像ファイルが見つかりません: {image_path}")
             return None
         
-        # データフレームから該当行を取得
-        row = df[df["filename"] == filename].iloc[0]
-        
         # 元の画像を読み込む
         image = Image.open(image_path).convert("RGB")
         
         # annotate時は中央値サイズにパディング
-        if annotate and pad_width and pad_height:
+        # （既に同じサイズならキャンバスを確保し直さない）
+        if annotate and pad_width and pad_height and image.size != (pad_width, pad_height):
             w, h = image.size
             new_img = Image.new("RGB", (pad_width, pad_height), (255, 255, 255))
             left = (pad_width - w) // 2
@@ -654,38 +965,29 @@ def classify_single_image(filename, df, image_folder, output_folder, uncertainty
             new_img.paste(image, (left, top))
             image = new_img
         
-        # 不確実性が閾値を超えるかチェック
-        is_uncertain_flag = row["is_uncertain"]
-        
-        # 保存先フォルダの決定
+        # 保存先フォルダの決定（不確実性が閾値を超えるものは unknown）
         if is_uncertain_flag:
             target_folder = "unknown"
         else:
-            target_folder = SEASON_FOLDERS[row["predicted_label"]]
+            target_folder = SEASON_FOLDERS[predicted_label]
         
         # 画像に情報を追加
-        probs = [row["spring"], row["summer"], row["autumn"], row["winter"]]
-        uncertainty_scores = {
-            "least_confidence": row["least_confidence"],
-            "margin_confidence": row["margin_confidence"],
-            "ratio_confidence": row["ratio_confidence"],
-            "entropy": row["entropy"]
-        }
+        uncertainty_scores = dict(zip(UNCERTAINTY_COLUMNS, uncertainty_values))
         
         output_path = os.path.join(output_folder, target_folder, filename)
         if annotate:
-            annotated_image = add_text_to_image(image, row["predicted_label"], probs, uncertainty_scores, uncertainty_metric)
-            annotated_image.save(output_path)
+            annotated_image = add_text_to_image(image, predicted_label, probs, uncertainty_scores, uncertainty_metric)
+            annotated_image.save(output_path, **SAVE_OPTIONS)
         else:
-            image.save(output_path)
+            image.save(output_path, **SAVE_OPTIONS)
         
         # 分類結果を記録
         classification_result = {
             "filename": filename,
-            "predicted_label": row["predicted_label"],
+            "predicted_label": predicted_label,
             "classified_folder": target_folder,
             "is_uncertain": is_uncertain_flag,
-            "uncertainty_value": row[uncertainty_metric],
+            "uncertainty_value": uncertainty_scores[uncertainty_metric],
             "uncertainty_metric": uncertainty_metric,
             "uncertainty_threshold": uncertainty_threshold
         }
@@ -710,11 +1012,11 @@ def print_statistics(df, uncertainty_metric, folder_counts, uncertainty_threshol
         df: 分析結果のデータフレーム
         uncertainty_metric: 不確実性の指標
         folder_counts: フォルダごとの画像数
-        uncertainty_threshold: 不確実性の閾値
+        uncertainty_threshold: 不確実性の閾値（判定結果は classify_images で求めた df["is_uncertain"] を使う）
     """
     logger.info("\n=== 分類結果 ===")
-    for folder_name, count in folder_counts.items():
-        logger.info(f"{folder_name}: {count} 枚")
+    for folder_name in SEASON_FOLDERS.values():
+        logger.info(f"{folder_name}: {folder_counts[folder_name]} 枚")
     
     # 不確実性指標の統計情報
     logger.info(f"\n=== 不確実性指標「{uncertainty_metric}」の統計 ===")
@@ -726,17 +1028,14 @@ def print_statistics(df, uncertainty_metric, folder_counts, uncertainty_threshol
     
     # 季節ごとの不確実性の平均
     logger.info("\n=== 季節ごとの不確実性平均 ===")
+    stats = df.groupby("predicted_label", sort=False).agg(
+        avg_metric=(uncertainty_metric, "mean"), n=("filename", "size"), uncertain=("is_uncertain", "sum")
+    )
     for season in SEASON_LABELS:
-        season_name = season.split()[-1]
-        season_df = df[df["predicted_label"] == season]
-        if len(season_df) > 0:
-            # 不確実性の判定
-            if uncertainty_metric == "margin_confidence":
-                uncertain_count = sum(season_df[uncertainty_metric] < uncertainty_threshold)
-            else:
-                uncertain_count = sum(season_df[uncertainty_metric] > uncertainty_threshold)
-                
-            logger.info(f"{season_name}: {season_df[uncertainty_metric].mean():.4f} (全 {len(season_df)} 枚中、不確実 {uncertain_count} 枚)")
+        if season in stats.index:
+            row = stats.loc[season]
+            season_name = season.split()[-1]
+            logger.info(f"{season_name}: {row['avg_metric']:.4f} (全 {int(row['n'])} 枚中、不確実 {int(row['uncertain'])} 枚)")
 
 # === メイン処理 ===
 def main(image_folder, base_output_folder, uncertainty_threshold=0.5, uncertainty_metric="entropy", 
@@ -758,7 +1057,7 @@ def main(image_folder, base_output_folder, uncertainty_threshold=0.5, uncertaint
         auto_mode: 自動最適化モード
         
     Returns:
-        tuple: (分析結果のデータフレーム, 出力フォルダのパス, 分類結果のリスト)
+        tuple: (分析結果のデータフレーム, 出力フォルダのパス, 分類結果 CSV のパス)
     """
     # 日本語フォントの設定
     setup_japanese_fonts()
@@ -787,14 +1086,15 @@ def main(image_folder, base_output_folder, uncertainty_threshold=0.5, uncertaint
         return df, None, None
     
     # 画像の分類
-    output_folder, classification_results = classify_images(
+    output_folder, classification_csv_path = classify_images(
         df, image_folder, base_output_folder, uncertainty_threshold, uncertainty_metric, max_workers, annotate, annotate_size
     )
     
-    return df, output_folder, classification_results
+    return df, output_folder, classification_csv_path
 
 # === CLI 引数対応 ===
 if __name__ == "__main__":
+    setup_logging()
     parser = argparse.ArgumentParser(description="季節ごとに画像を分類し、不確実な画像を特定します")
     parser.add_argument("--folder", type=str, default=DEFAULT_IMAGE_FOLDER, help="入力画像フォルダのパス")
     parser.add_argument("--output", type=str, default=DEFAULT_OUTPUT_FOLDER, help="出力フォルダのパス")
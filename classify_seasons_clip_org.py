@@ -1,6 +1,7 @@
 import os
 from PIL import Image
 import torch
+import torch.nn.functional as F
 from transformers import CLIPProcessor, CLIPModel
 from tqdm import tqdm
 import pandas as pd
@@ -22,6 +23,15 @@ SEASON_LABELS = [
 device = "cuda" if torch.cuda.is_available() else "cpu"
 model = CLIPModel.from_pretrained("openai/clip-vit-base-patch32").to(device)
 processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+model.eval()
+if device == "cuda":
+    model = model.half()  # 推論のみなので FP16 で十分
+
+# ラベルは固定なので、テキスト埋め込みは起動時に 1 回だけ計算する
+with torch.inference_mode():
+    text_inputs = processor(text=SEASON_LABELS, return_tensors="pt", padding=True).to(device)
+    TEXT_FEATURES = F.normalize(model.get_text_features(**text_inputs).float(), dim=-1)
+    LOGIT_SCALE = model.logit_scale.exp()
 
 # === 分類処理 ===
 def classify_image(image_path):
@@ -31,9 +41,13 @@ def classify_image(image_path):
         print(f"Failed to load image: {image_path} ({e})")
         return None, None, None
     
-    inputs = processor(text=SEASON_LABELS, images=image, return_tensors="pt", padding=True).to(device)
-    outputs = model(**inputs)
-    probs = outputs.logits_per_image.softmax(dim=1).detach().cpu().numpy()[0]
+    inputs = processor(images=image, return_tensors="pt").to(device)
+    with torch.inference_mode():
+        pixel_values = inputs["pixel_values"].to(model.dtype)
+        # softmax で FP16 の丸め誤差が出ないよう、類似度は FP32 で計算する
+        image_features = F.normalize(model.get_image_features(pixel_values=pixel_values).float(), dim=-1)
+        logits = LOGIT_SCALE * image_features @ TEXT_FEATURES.T
+    probs = logits.softmax(dim=1).cpu().numpy()[0]
     top_idx = probs.argmax()
     return image, SEASON_LABELS[top_idx], probs
 
@@ -48,13 +62,14 @@ def show_image(image, label, probs):
 
 # === メイン処理 ===
 def main(image_folder, preview=False):
-    image_files = [f for f in os.listdir(image_folder) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+    with os.scandir(image_folder) as it:
+        image_files = [e for e in it if e.is_file() and e.name.lower().endswith(('.jpg', '.jpeg', '.png'))]
     results = []
     
     print(f"Classifying {len(image_files)} images...")
     
-    for filename in tqdm(image_files):
-        image_path = os.path.join(image_folder, filename)
+    for entry in tqdm(image_files):
+        filename, image_path = entry.name, entry.path
         image, label, probs = classify_image(image_path)
         if image is not None:
             results.append({
@@ -111,29 +111,60 @@ export default function App() {
         setProgress(0);
         setClassificationResults([]);
         try {
-            const progressTimer = setInterval(() => {
-                setProgress(prev => Math.min(prev + 1, 99));
-            }, 1000);
+            // /classify/scan は NDJSON で 1 行ずつ結果を返す
+            const res = await fetch(`${API_BASE}/api/classify/scan`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({
+                    folder: targetFolder,
+                    threshold: threshold,
+                    metric: metric,
+                    workers: workers
+                })
+            });
 
-            const res = await axios.post(`${API_BASE}/api/classify/scan`, {
-                folder: targetFolder,
-                threshold: threshold,
-                metric: metric,
-                workers: workers
-            }, { timeout: 600000 });
+            if (!res.ok || !res.body) {
+                const body = await res.json().catch(() => null);
+                throw new Error(body?.detail || res.statusText);
+            }
+
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            const results: any[] = [];
+            let buffer = '';
+            let total = 0;
+
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split('\n');
+                buffer = lines.pop() || '';
+
+                let received = false;
+                for (const line of lines) {
+                    if (!line.trim()) continue;
+                    const event = JSON.parse(line);
+                    if (event.event === 'start') {
+                        total = event.total;
+                    } else if (event.event === 'result') {
+                        results.push(event.result);
+                        received = true;
+                    } else if (event.event === 'progress' && total > 0) {
+                        setProgress(Math.min(Math.round((event.scanned / total) * 100), 99));
+                    }
+                }
+                if (received) setClassificationResults([...results]);
+            }
 
-            clearInterval(progressTimer);
             setProgress(100);
             await new Promise(r => setTimeout(r, 200));
 
-            if (res.data.results && res.data.results.length > 0) {
-                setClassificationResults(res.data.results);
-            } else {
+            if (results.length === 0) {
                 showMessage('info', `解析対象の画像が見つからないか、処理がスキップされました。`);
             }
         } catch (error: any) {
-            const detail = error.response?.data?.detail || error.message;
-            showMessage('error', `分類中にエラーが発生しました: ${detail}`);
+            showMessage('error', `分類中にエラーが発生しました: ${error.message}`);
         } finally {
             setScanning(false);
         }
@@ -231,6 +262,7 @@ export default function App() {
         const newResults = [...classificationResults];
         const item = { ...newResults[index] };
         item.prediction = `a photo of ${newSeason}`;
+        item.label = newSeason;
         item.is_unknown = false;
         newResults[index] = item;
         setClassificationResults(newResults);
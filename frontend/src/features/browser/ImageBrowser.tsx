@@ -251,7 +251,7 @@ export const ImageBrowser = ({ targetFolder }: ImageBrowserProps) => {
                                     onClick={() => setLightboxIndex(idx)}
                                 >
                                     <img
-                                        src={`${API_BASE}/api/browser/image?path=${encodeURIComponent(img.path)}`}
+                                        src={`${API_BASE}/api/browser/image?path=${encodeURIComponent(img.path)}&w=512`}
                                         alt={img.filename}
                                         className="w-full h-full object-cover group-hover:scale-110 transition-transform duration-500"
                                         loading="lazy"
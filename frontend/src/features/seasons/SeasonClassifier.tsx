@@ -198,7 +198,7 @@ export const SeasonClassifier = ({
                                                             }`}
                                                     >
                                                         <img
-                                                            src={`${API_BASE}/api/images/preview?path=${encodeURIComponent(r.path)}`}
+                                                            src={`${API_BASE}/api/images/preview?path=${encodeURIComponent(r.path)}&w=512`}
                                                             className={`w-full h-full object-cover ${r.is_unknown ? 'sepia-[0.3] opacity-70' : ''}`}
                                                             alt=""
                                                         />